@@ -0,0 +1,255 @@
+import numpy as np
+from utils import *
+from filter_index import FilterIndex
+
+DISCOUNT_AMOUNT_COLUMNS = ['Standard Discount [SD1][CAD]', 'Standard Discount [SD2][CAD]',
+                           'Special Discount [DSP][CAD]', 'Promo Campaign [DPR][CAD]']
+EXPENSE_COLUMNS = DISCOUNT_AMOUNT_COLUMNS + ['Rebates [DREB][CAD]']
+
+# Customer charts show this many customers by default, the rest is bucketed into OTHER_LABEL
+TOP_CUSTOMERS = 20
+OTHER_LABEL = "Other"
+
+MONTHLY_MEASURES = (['Revenue', 'QTY [Units]', 'Total GM [CAD]', 'Total Expense', 'CoGS', 'Net Profit']
+                    + list(WEIGHTED_DISCOUNT_COLUMNS) + EXPENSE_COLUMNS)
+
+
+def values(df, column):
+    # Read-only NumPy view of a column, derived metric columns come from pre_process_data
+    return df[column].to_numpy()
+
+
+def widen(measures):
+    # Rows are stored in float32/int32, sums are accumulated in float64/int64 so totals over many rows keep
+    # their cents and unit counts do not overflow
+    wide = {"f": np.float64, "i": np.int64, "u": np.int64}
+    return measures.astype({column: wide[measures[column].dtype.kind] for column in measures.columns
+                            if measures[column].dtype.kind in wide})
+
+
+@instrument
+def monthly_totals(df):
+    # Additive monthly sums, partial results from several chunks can be combined with combine_monthly
+    # CoGS is reported straight from the total cost column
+    measures = pd.DataFrame({column: values(df, 'Total Cost [CAD]' if column == 'CoGS' else column)
+                             for column in MONTHLY_MEASURES}, index=df.index)
+    return widen(measures).groupby(df["MONTH"], observed=True).sum()
+
+
+def combine_monthly(parts):
+    monthly = pd.concat(parts)
+    monthly.index = monthly.index.astype(object)
+    return monthly.groupby(level=0).sum()
+
+
+def unfinish_monthly(monthly):
+    # Back from the finished monthly summary to the additive totals, months without data are dropped again
+    totals = monthly.set_index("MONTH")[MONTHLY_MEASURES]
+    totals.index = totals.index.astype(object)
+    return totals.dropna(how="all")
+
+
+def finish_monthly(totals):
+    monthly = totals.reindex(MONTHS_ORDER)
+    monthly.index.name = "MONTH"
+
+    monthly['Profit Margin'] = (monthly['Total GM [CAD]'] / monthly['Revenue']) * 100
+    monthly['Avg Discount Rate'] = monthly[list(WEIGHTED_DISCOUNT_COLUMNS)].sum(axis=1) / monthly['Revenue']
+    monthly['ASP'] = monthly['Revenue'] / monthly['QTY [Units]']
+    return monthly.reset_index()
+
+
+def monthly_summary(df):
+    # Single pass over the raw rows producing every monthly figure the Overview tab needs
+    return finish_monthly(monthly_totals(df))
+
+
+# Grain of the pre-aggregated cube serving the Customer Insights and Product Performance tabs
+CUBE_DIMENSIONS = ["YEAR", "MONTH", "Channel Category", "Customer Name",
+                   "Product Category", "Product Family", "Product Range"]
+
+# Columns averaged by the charts are kept as a sum plus a non-null count so they stay additive
+CUBE_MEAN_COLUMNS = ["Total Discount", "List Price [CAD]", "Unit GM [%]"]
+
+
+@instrument
+def build_cube(df):
+    measures = pd.DataFrame({
+        "Revenue": values(df, "Revenue"),
+        "Total GM [CAD]": values(df, "Total GM [CAD]"),
+        "QTY [Units]": values(df, "QTY [Units]"),
+        "Total Discount": values(df, "Total Discount"),
+        "List Price [CAD]": values(df, "List Price [CAD]"),
+        "Unit GM [%]": values(df, "Unit GM [%]"),
+    }, index=df.index)
+    aggregations = {
+        "Revenue": ("Revenue", "sum"),
+        "Total GM [CAD]": ("Total GM [CAD]", "sum"),
+        "QTY [Units]": ("QTY [Units]", "sum"),
+        "Rows": ("Revenue", "size"),
+    }
+    for column in CUBE_MEAN_COLUMNS:
+        aggregations[column] = (column, "sum")
+        aggregations[f"{column} Count"] = (column, "count")
+    keys = [df[column] for column in CUBE_DIMENSIONS]
+    return widen(measures).groupby(keys, dropna=False, observed=True).agg(**aggregations).reset_index()
+
+
+def combine_cubes(parts):
+    # Grouped on unified categorical dimensions, object keys would make the regrouping several times slower
+    cube = pd.concat(unify_categories(parts, CATEGORY_COLUMNS), ignore_index=True)
+    cube = cube.groupby(CUBE_DIMENSIONS, dropna=False, observed=True).sum().reset_index()
+    return encode_dimensions(cube)
+
+
+def fold_cubes(cube, parts):
+    # Regroups `parts` into the running `cube` (None before the first fold)
+    if not parts:
+        return cube
+    return combine_cubes(parts if cube is None else [cube] + parts)
+
+
+def encode_dimensions(cube):
+    for column in CUBE_DIMENSIONS:
+        if column in CATEGORY_COLUMNS:
+            cube[column] = cube[column].astype("category")
+    return cube
+
+
+def cube_mean(cube, by, column):
+    sums = cube.groupby(by, observed=True)[[column, f"{column} Count"]].sum()
+    return sums[column] / sums[f"{column} Count"]
+
+
+def customer_totals(cube):
+    # One row per customer with additive measures, the average discount is rebuilt from its sum and count
+    totals = cube.groupby("Customer Name", observed=True)[
+        ["Revenue", "Total GM [CAD]", "QTY [Units]", "Total Discount", "Total Discount Count"]].sum()
+    totals["Avg Discount"] = totals["Total Discount"] / totals["Total Discount Count"]
+    return totals.reset_index()
+
+
+def top_n_with_other(totals, label, by, n):
+    # Keeps the n largest rows by `by` in descending order and sums the long tail into a single "Other" row.
+    # argpartition selects the top n in linear time, only those n rows are then sorted.
+    if len(totals) <= n:
+        return totals.sort_values(by, ascending=False, ignore_index=True)
+    ranking = np.nan_to_num(totals[by].to_numpy(dtype=np.float64), nan=-np.inf)
+    top = np.argpartition(-ranking, n - 1)[:n]
+    top = top[np.argsort(-ranking[top], kind="stable")]
+    tail = np.ones(len(totals), dtype=bool)
+    tail[top] = False
+
+    head = totals.iloc[top].reset_index(drop=True)
+    head[label] = head[label].astype(object)
+    other = totals[tail].drop(columns=label).sum()
+    other[label] = OTHER_LABEL
+    # Ratio columns of the "Other" row are meaningless as sums, callers recompute them from the additive columns
+    return pd.concat([head, pd.DataFrame([other])], ignore_index=True)
+
+
+@instrument
+def build_dataset(df):
+    # Everything the dashboards read, computed once per uploaded file
+    cube = build_cube(df)
+    return {
+        "rows": df,
+        "monthly": monthly_summary(df),
+        "cube": cube,
+        "filter_index": FilterIndex(cube),
+    }
+
+
+def dataset_from_aggregates(monthly, cube):
+    # Dataset restored without its rows, e.g. from storage, the lookup structures are rebuilt from the cube
+    cube = encode_dimensions(cube)
+    return {
+        "rows": None,
+        "monthly": monthly,
+        "cube": cube,
+        "filter_index": FilterIndex(cube),
+    }
+
+
+@instrument
+def build_dataset_from_chunks(chunks, on_chunk=None, keep_rows=False):
+    # Streaming variant of build_dataset: each pre-processed chunk is folded into the running aggregates
+    # and dropped, so peak memory is bounded by the chunk size and the aggregate sizes, not the file size.
+    # With `keep_rows` the pre-processed chunks are kept instead and aggregated in one pass at the end.
+    # `on_chunk(rows, snapshot)` is called after every chunk; `snapshot()` builds the dataset of the chunks read
+    # so far, e.g. to show early charts, and is only worth calling every now and then.
+    # Chunk cubes are collected and only regrouped once they outgrow the cube combined so far, so each cube
+    # row is regrouped a logarithmic number of times rather than once per chunk
+    monthly, cube, pending, rows, folded = None, None, [], [], 0
+
+    def fold(chunk):
+        nonlocal monthly, cube, pending
+        chunk_monthly = monthly_totals(chunk)
+        monthly = chunk_monthly if monthly is None else combine_monthly([monthly, chunk_monthly])
+        pending.append(build_cube(chunk))
+        if cube is None or sum(len(part) for part in pending) >= len(cube):
+            cube, pending = fold_cubes(cube, pending), []
+
+    def snapshot():
+        # Kept chunks are only aggregated here, when a snapshot asks for them
+        nonlocal cube, pending, folded
+        for chunk in rows[folded:]:
+            fold(chunk)
+        folded = len(rows)
+        cube, pending = fold_cubes(cube, pending), []
+        return {"rows": None, "monthly": finish_monthly(monthly), "cube": cube, "filter_index": FilterIndex(cube)}
+
+    for chunk in chunks:
+        chunk = pre_process_data(chunk)
+        if keep_rows:
+            rows.append(chunk)
+        else:
+            fold(chunk)
+        if on_chunk is not None:
+            on_chunk(len(chunk), snapshot)
+    if keep_rows:
+        return build_dataset(concat_rows(rows))
+    cube = fold_cubes(cube, pending)
+    return {
+        "rows": None,
+        "monthly": finish_monthly(monthly),
+        "cube": cube,
+        "filter_index": FilterIndex(cube),
+    }
+
+
+class PeriodOverlapError(ValueError):
+    """
+    Raised when an appended file covers a YEAR/MONTH period the dataset already holds.
+    """
+
+
+def dataset_periods(dataset):
+    cube = dataset["cube"]
+    return set(zip(cube["YEAR"].tolist(), cube["MONTH"].astype(object).tolist()))
+
+
+@instrument
+def append_dataset(dataset, addition):
+    # Merges the aggregates of a newly processed file into an existing dataset. The periods must not overlap,
+    # so no cube group collides and the cubes are only concatenated; the work grows with the cube and the new
+    # file, never with the rows behind the history. The merged dataset keeps no rows.
+    overlap = dataset_periods(dataset) & dataset_periods(addition)
+    if overlap:
+        order = {month: position for position, month in enumerate(MONTHS_ORDER)}
+        overlap = sorted(overlap, key=lambda period: (period[0], order.get(period[1], len(order))))
+        periods = ", ".join(f"{month} {year}" for year, month in overlap)
+        raise PeriodOverlapError(f"The file repeats periods already in the dataset: {periods}")
+
+    totals = combine_monthly([unfinish_monthly(dataset["monthly"]), unfinish_monthly(addition["monthly"])])
+    cube = pd.concat([dataset["cube"], addition["cube"]], ignore_index=True)
+    for column in CUBE_DIMENSIONS:
+        if column in CATEGORY_COLUMNS:
+            cube[column] = cube[column].astype(object)
+    cube = encode_dimensions(cube)
+    return {
+        "rows": None,
+        "monthly": finish_monthly(totals),
+        "cube": cube,
+        "filter_index": FilterIndex(cube),
+    }
@@ -1,9 +1,28 @@
+import multiprocessing
+import os
+import secrets
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
 import pandas as pd
 import streamlit as st
+from streamlit.runtime import get_instance
+from streamlit.runtime.scriptrunner import get_script_run_ctx
 from streamlit_option_menu import option_menu
 from plots.plots import *
+from plots.compact import compact_figure
 from utils import *
-from pymongo import MongoClient
+from aggregates import *
+from cache import DatasetRegistry, FigureCache, content_hash, prune_directory
+from auth import *
+from instrumentation import *
+from backends import BACKENDS
+from jobs import JobRegistry
+from preview import build_preview
+from shared import open_shared_dataset, share_dataset, shared_path, write_shared_dataset
+from ingest import DASHBOARD_COLUMNS, convert_excel, excel_header, excel_sheets, load_excel
+from storage import list_datasets, load_dataset_aggregates, save_dataset
 
 # ------------------------------ Page Configuration------------------------------
 st.set_page_config(page_title="Aitionics", page_icon="📊", layout="wide")
@@ -41,33 +60,349 @@ with st.sidebar:
     # st.image("./assets/logo.png", width=200)
     st.markdown('<p class="logo">Aitionics</p>', unsafe_allow_html=True)
 
-# MongoDB client setup
-client = MongoClient(st.secrets["mongo"]["con_string"])
-db = client[st.secrets["mongo"]["db"]]
-users = db[st.secrets["mongo"]["users"]]
+# MongoDB client setup: one pooled client per server process instead of one per rerun
+@st.cache_resource
+def get_mongo_client():
+    mongo = st.secrets["mongo"]
+    return create_client(mongo["con_string"], mongo.get("max_pool_size", MONGO_POOL_SIZE))
+
+
+def get_database():
+    return get_mongo_client()[st.secrets["mongo"]["db"]]
+
+
+@st.cache_resource
+def get_users_collection():
+    users = get_database()[st.secrets["mongo"]["users"]]
+    ensure_user_index(users)
+    return users
+
+
+@st.cache_resource
+def get_session_secret():
+    # Without a configured secret, tokens are signed with a per-process key and expire on restart
+    return st.secrets.get("auth", {}).get("secret") or secrets.token_hex(32)
+
+
+# Rows per page of the full customer table
+CUSTOMER_PAGE_ROWS = 100
+
+
+def is_admin(username):
+    return username in st.secrets.get("auth", {}).get("admins", [])
+
+
+def show_timing_panel(records):
+    with st.sidebar.expander("Performance", expanded=True):
+        st.dataframe(pd.DataFrame(records), use_container_width=True, hide_index=True)
+        payload = sum(record.get("bytes", 0) for record in records)
+        st.caption(f'Total {sum(record["seconds"] for record in records):.3f} s, '
+                   f'figure payload {format_bytes(payload)}, figure cache {get_figure_cache().stats()}, '
+                   f'datasets {get_dataset_registry().stats()}')
+    log_records(records)
+    prometheus_path = st.secrets.get("instrumentation", {}).get("prometheus_path")
+    if prometheus_path:
+        write_prometheus(prometheus_path, records)
+
+
+@st.cache_resource
+def get_dataset_registry():
+    # Memory budget for parsed datasets shared by all sessions of this server process, evicted datasets are
+    # spilled to the shared Arrow directory and memory-mapped again on their next use
+    max_mb = st.secrets.get("cache", {}).get("max_mb", 2048)
+    shared_dir = get_shared_dir()
+    # Created once per server process, the disk caches left by earlier runs are trimmed to their caps here
+    prune_disk_caches()
+
+    def spill(key, dataset):
+        write_shared_dataset(shared_dir, key, dataset)
+        prune_disk_caches(shared_path(shared_dir, key))
+
+    return DatasetRegistry(max_bytes=max_mb * 1024 ** 2, spill=spill,
+                           reload=lambda key: open_shared_dataset(shared_dir, key))
+
+
+def track_session_dataset(dataset_key):
+    # Reference counts of the registry, sessions closed since the last rerun give up their dataset
+    registry = get_dataset_registry()
+    registry.prune(get_instance().is_active_session)
+    session_id = get_script_run_ctx().session_id
+    if dataset_key is None:
+        registry.release(session_id)
+    else:
+        registry.acquire(session_id, dataset_key)
+
+
+@st.cache_resource
+def get_figure_cache():
+    max_figures = st.secrets.get("cache", {}).get("max_figures", 256)
+    return FigureCache(max_entries=max_figures)
+
+
+# With [parallel] mode = "process", figures over frames at least this long are built in worker processes
+PROCESS_POOL_MIN_ROWS = 1_000_000
+
+
+@st.cache_resource
+def get_thread_pool():
+    return ThreadPoolExecutor(max_workers=st.secrets.get("parallel", {}).get("workers", 4),
+                              thread_name_prefix="figures")
+
+
+@st.cache_resource
+def get_process_pool():
+    # spawn keeps the workers independent of the server's threads, they only import the plot modules
+    return ProcessPoolExecutor(max_workers=st.secrets.get("parallel", {}).get("workers", 4),
+                               mp_context=multiprocessing.get_context("spawn"))
+
+
+def show_charts(dataset_key, charts, data, filters=(), **options):
+    # `charts` is a list of (slot, builder) pairs. The figures are independent, so they are built concurrently
+    # on a bounded pool (pandas releases the GIL in its grouping loops) and placed into their slots in order.
+    mode = st.secrets.get("parallel", {}).get("mode", "thread")
+    process_pool = get_process_pool() if mode == "process" and len(data) >= PROCESS_POOL_MIN_ROWS else None
+    cache = get_figure_cache()
+
+    def build(builder):
+        # Figures are compacted once before caching, every later rerun sends the small payload
+        if process_pool is not None:
+            return compact_figure(process_pool.submit(builder, data, **options).result())
+        return compact_figure(builder(data, **options))
+
+    def figure(builder):
+        with timed(f"figure {builder.__name__}"):
+            if dataset_key is None:
+                # Charts of a dataset still loading are shown once, caching them would only evict useful figures
+                return build(builder)
+            key = (dataset_key, builder.__name__, filters, tuple(sorted(options.items())))
+            return cache.get_or_build(key, lambda: build(builder))
+
+    if mode == "off":
+        results = [figure(builder) for _, builder in charts]
+    else:
+        pool = get_thread_pool()
+        results = [pool.submit(propagate(figure), builder) for _, builder in charts]
+    for (slot, builder), result in zip(charts, results):
+        fig = result if mode == "off" else result.result()
+        record_payload(builder.__name__, fig)
+        slot.plotly_chart(fig, use_container_width=True)
+
+
+def get_parquet_dir():
+    default = os.path.join(tempfile.gettempdir(), "aitionics-parquet")
+    return st.secrets.get("ingest", {}).get("cache_dir", default)
+
+
+def get_shared_dir():
+    # Processed datasets are written here once and memory-mapped by every session and process on the node
+    default = os.path.join(tempfile.gettempdir(), "aitionics-arrow")
+    return st.secrets.get("shared", {}).get("dir", default)
+
+
+def get_upload_dir():
+    # Copies of CSV uploads scanned in place by the DuckDB backend
+    default = os.path.join(tempfile.gettempdir(), "aitionics-uploads")
+    return st.secrets.get("aggregation", {}).get("upload_dir", default)
+
+
+def prune_disk_caches(*keep):
+    # The on-disk caches are capped by size (in MB), least recently used entries are removed first
+    prune_directory(get_shared_dir(), st.secrets.get("shared", {}).get("max_mb", 20480) * 1024 ** 2, keep)
+    prune_directory(get_parquet_dir(), st.secrets.get("ingest", {}).get("cache_max_mb", 10240) * 1024 ** 2, keep)
+    prune_directory(get_upload_dir(), st.secrets.get("aggregation", {}).get("upload_max_mb", 10240) * 1024 ** 2,
+                    keep)
 
 
-def check_user(username, password):
-    user = users.find_one({"username": username})
-    if user['password']==password:
-        return True
-    return False
+def upload_key(file_upload):
+    # Remember the content hash per upload so reruns don't re-hash the file
+    hashes = st.session_state.setdefault("upload_hashes", {})
+    if file_upload.file_id not in hashes:
+        hashes[file_upload.file_id] = content_hash(file_upload.getvalue())
+    return hashes[file_upload.file_id]
+
+
+def workbook_sheets(file_upload):
+    sheets = st.session_state.setdefault("workbook_sheets", {})
+    content_key = upload_key(file_upload)
+    if content_key not in sheets:
+        sheets[content_key] = excel_sheets(file_upload, file_upload.type)
+    return sheets[content_key]
+
+
+def sheet_header(file_upload, sheet):
+    headers = st.session_state.setdefault("sheet_headers", {})
+    key = (upload_key(file_upload), sheet)
+    if key not in headers:
+        headers[key] = excel_header(file_upload, file_upload.type, sheet)
+    return headers[key]
+
+
+def excel_selection(file_upload, several):
+    if file_upload.type == "text/csv":
+        return None
+    # Widgets are keyed per upload so several workbooks each get their own sheet selection
+    suffix = f" ({file_upload.name})" if several else ""
+    sheet = st.sidebar.selectbox(label=f"Sheet{suffix}", options=workbook_sheets(file_upload),
+                                 key=f"sheet-{file_upload.file_id}")
+    header = sheet_header(file_upload, sheet)
+    # A sheet without the dashboard columns is rejected before it is converted
+    check_columns(header)
+    # The dashboard columns are always loaded, any other column is opt-in
+    extra = st.sidebar.multiselect(label=f"Extra columns{suffix}",
+                                   options=[column for column in header if column not in DASHBOARD_COLUMNS],
+                                   key=f"columns-{file_upload.file_id}")
+    return sheet, tuple(column for column in header if column in DASHBOARD_COLUMNS or column in extra)
+
+
+def read_rows(file_upload, content_key, excel, progress=None):
+    if excel is None:
+        return read_upload(file_upload)
+    sheet, columns = excel
+    return load_excel(file_upload, file_upload.type, content_key, sheet, list(columns), get_parquet_dir(), progress)
+
+
+def make_backend(file_upload, content_key, excel=None, progress=None):
+    settings = st.secrets.get("aggregation", {})
+    backend = BACKENDS[settings.get("backend", "pandas")]
+    if backend.name == "duckdb":
+        if file_upload.type == "text/csv":
+            # DuckDB scans the CSV in place, the upload is written to disk once per content hash
+            path = os.path.join(get_upload_dir(), f"{content_key}.csv")
+            try:
+                # Marks the copy as recently used for the size cap of the upload directory
+                os.utime(path)
+            except FileNotFoundError:
+                os.makedirs(get_upload_dir(), exist_ok=True)
+                with open(f"{path}.tmp", "wb") as f:
+                    f.write(file_upload.getbuffer())
+                os.replace(f"{path}.tmp", path)
+            return backend(path, settings.get("threads"))
+        # Workbooks: the converted sheet is scanned in place, only the columns a query touches are read
+        path = convert_excel(file_upload, file_upload.type, content_key, excel[0], get_parquet_dir(), progress)
+        return backend(path, settings.get("threads"))
+    return backend(pre_process_data(read_rows(file_upload, content_key, excel, progress)))
+
+
+@st.cache_resource
+def get_ingest_jobs():
+    # Uploads are parsed and aggregated off the script thread, so the page stays responsive and reruns
+    # (any click) attach to the running job instead of restarting the parse
+    return JobRegistry(ThreadPoolExecutor(max_workers=st.secrets.get("ingest", {}).get("workers", 2)))
+
+
+# Seconds between two reruns refreshing the progress of running ingestion jobs
+INGEST_POLL_SECONDS = 1
+
+# Minimum interval between two datasets of the chunks read so far, each one regroups the cube and its filter index
+PARTIAL_SECONDS = 5
+
+
+def ingest(job, file_upload, content_key, streaming, excel, key, shared_dir, preview):
+    # Runs on the ingestion pool. CSV files on the pandas backend are read chunk by chunk so the charts of
+    # the chunks read so far can be shown; workbooks and the DuckDB backend report progress only.
+    # In preview mode a sampled estimate of the whole CSV is published first and kept until the exact result.
+    if file_upload.type == "text/csv":
+        check_columns(read_csv_header(file_upload))
+    if preview and file_upload.type == "text/csv":
+        partial, estimate = build_preview(file_upload, job.total_bytes)
+        job.report(partial=partial, estimate=estimate)
+        file_upload.seek(0)
+
+    pandas_backend = st.secrets.get("aggregation", {}).get("backend", "pandas") == "pandas"
+    if file_upload.type == "text/csv" and (streaming or pandas_backend):
+        published = time.monotonic()
+
+        def on_chunk(rows, snapshot):
+            nonlocal published
+            partial = None
+            if not job.estimate and time.monotonic() - published >= PARTIAL_SECONDS:
+                partial, published = snapshot(), time.monotonic()
+            job.report(rows, file_upload.tell(), partial)
+        dataset = build_dataset_from_chunks(read_csv_chunks(file_upload), on_chunk, keep_rows=not streaming)
+    else:
+        dataset = make_backend(file_upload, content_key, excel, lambda rows: job.report(rows)).dataset()
+    job.report(bytes_read=job.total_bytes)
+    dataset = share_dataset(shared_dir, key, dataset)
+    prune_disk_caches(shared_path(shared_dir, key))
+    return dataset
+
+
+def load_dataset(file_upload, streaming=False, excel=None, preview=False):
+    # Derived metric definitions are part of the key so a definition change invalidates cached datasets
+    content_key = upload_key(file_upload)
+    backend = st.secrets.get("aggregation", {}).get("backend", "pandas")
+    key = f'{content_key}:v{DERIVED_METRICS_VERSION}'
+    if streaming:
+        key += ":stream"
+    elif backend != "pandas":
+        key += f":{backend}"
+    if excel is not None:
+        # Sheet and column selection, as a short digest so the key stays usable as a storage id
+        sheet, columns = excel
+        key += ":" + content_hash("\0".join([sheet, *columns]).encode())[:12]
+
+    # The registry also finds datasets processed by another server process on this node, or spilled earlier
+    registry = get_dataset_registry()
+    dataset = registry.get(key)
+    if dataset is not None:
+        return key, dataset, None
+
+    # Otherwise the file is ingested in the background, while it runs the job and its partial dataset
+    # (or None) are returned
+    jobs = get_ingest_jobs()
+    shared_dir = get_shared_dir()
+    job = jobs.submit(key, file_upload.name, file_upload.size,
+                      lambda job: ingest(job, file_upload, content_key, streaming, excel, key, shared_dir, preview))
+    if not job.done():
+        return key, job.partial, job
+    jobs.pop(key)
+    return key, registry.put(key, job.result()), None
+
+
+def append_datasets(loaded):
+    # Every prefix of the upload list is kept in the registry under a key chained from its files' keys, so
+    # adding next month's export only processes that file and merges its aggregates into the cached prefix
+    registry = get_dataset_registry()
+    key, dataset = loaded[0]
+    for addition_key, addition in loaded[1:]:
+        key = content_hash(f"{key}+{addition_key}".encode())
+        appended = registry.get(key)
+        if appended is None:
+            appended = registry.put(key, share_dataset(get_shared_dir(), key, append_dataset(dataset, addition)))
+        dataset = appended
+    return key, dataset
+
+
+@st.cache_data(ttl=60)
+def list_saved_datasets():
+    return {saved["_id"]: saved["name"] for saved in list_datasets(get_database())}
+
+
+def open_saved_dataset(key):
+    # Saved datasets are opened from their stored aggregates only, the rows stay in GridFS
+    registry = get_dataset_registry()
+    dataset = registry.get(key)
+    if dataset is None:
+        dataset = registry.put(key, load_dataset_aggregates(get_database(), key))
+    return key, dataset
 
 
 def logout():
-    st.session_state['authenticated'] = False
+    st.session_state.pop('session_token', None)
     st.experimental_rerun()
 
 
 def main():
-    if 'authenticated' not in st.session_state or not st.session_state['authenticated']:
+    # A signed session token is verified locally, reruns of a logged-in session never query MongoDB
+    username = verify_session_token(st.session_state.get('session_token'), get_session_secret())
+    if username is None:
         st.sidebar.title("Login")
         username = st.sidebar.text_input("Username")
         password = st.sidebar.text_input("Password", type='password')
 
         if st.sidebar.button('Login'):
-            if check_user(username, password):
-                st.session_state['authenticated'] = True
+            if check_user(get_users_collection(), username, password):
+                st.session_state['session_token'] = make_session_token(username, get_session_secret())
                 st.experimental_rerun()
             else:
                 st.error("Incorrect username or password.")
@@ -77,19 +412,78 @@ def main():
         if st.sidebar.button('Logout'):
             logout()
 
-        df = pd.DataFrame()
+        # Admin-only timing of this rerun, reset on every rerun so a failed run never leaves it switched on
+        profiling = is_admin(username) and st.sidebar.toggle("Record timings")
+        if profiling:
+            start_recording()
+        else:
+            stop_recording()
+
+        file_uploads = st.sidebar.file_uploader("", type=["csv", "xlsx", "xls"], accept_multiple_files=True)
 
-        file_upload = st.sidebar.file_uploader("", type=["csv", "xlsx", "xls"], )
+        dataset_key, dataset, pending = None, None, []
+        if file_uploads:
+            streaming, preview = False, False
+            if any(file_upload.type == "text/csv" for file_upload in file_uploads):
+                streaming = st.sidebar.toggle("Stream large CSV", help="Aggregate the file chunk by chunk "
+                                                                       "without keeping the rows in memory")
+                preview = st.sidebar.toggle("Preview while loading", help="Show estimates from a stratified sample "
+                                                                          "until the exact figures are ready")
+            try:
+                with timed("load dataset"):
+                    loaded = [load_dataset(file_upload, streaming and file_upload.type == "text/csv",
+                                           excel_selection(file_upload, len(file_uploads) > 1), preview)
+                              for file_upload in file_uploads]
+            except SchemaError as error:
+                st.sidebar.error(str(error))
+                loaded = []
+            pending = [job for _, _, job in loaded if job is not None]
+            for job in pending:
+                st.sidebar.progress(job.fraction(), text=f"Loading {job.name}: {job.rows:,} rows, "
+                                                         f"{format_bytes(job.bytes)} of {format_bytes(job.total_bytes)}")
+            if loaded and not pending:
+                try:
+                    dataset_key, dataset = append_datasets([(key, dataset) for key, dataset, _ in loaded])
+                except PeriodOverlapError as error:
+                    st.sidebar.error(str(error))
+            elif len(loaded) == 1 and loaded[0][1] is not None and pending[0].estimate:
+                estimate = pending[0].estimate
+                dataset_key, dataset = f"{loaded[0][0]}:preview", loaded[0][1]
+                st.info(f'Preview from {estimate["sample_rows"]:,} of about {estimate["estimated_rows"]:,} rows: '
+                        f'sums are scaled-up estimates, total revenue within ±{estimate["revenue_error"]:.1%} '
+                        f'(95%). Exact figures replace them when loading finishes.')
+            elif len(loaded) == 1 and loaded[0][1] is not None:
+                # Charts of the chunks read so far, without a key they bypass the figure cache
+                dataset = loaded[0][1]
 
-        if file_upload is not None:
-            if file_upload.type == "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet":
-                df = pd.read_excel(file_upload, engine="openpyxl")
-            elif file_upload.type == "application/vnd.ms-excel":  # Check if it's an XLS file
-                df = pd.read_excel(file_upload)
-            elif file_upload.type == "text/csv":  # Check if it's a CSV file
-                df = pd.read_csv(file_upload, encoding=("UTF-8"))
+            if dataset is not None and not pending:
+                with st.sidebar.expander("Save dataset"):
+                    name = st.text_input("Name", value=" + ".join(file_upload.name for file_upload in file_uploads))
+                    if st.button("Save"):
+                        save_dataset(get_database(), dataset_key, name, dataset)
+                        list_saved_datasets.clear()
+                        st.success(f"Saved as {name}")
+        else:
+            saved = list_saved_datasets()
+            saved_key = st.sidebar.selectbox(label="Saved datasets", options=[None] + list(saved),
+                                             format_func=lambda key: "Upload a file" if key is None else saved[key])
+            if saved_key is not None:
+                with timed("open saved dataset"):
+                    dataset_key, dataset = open_saved_dataset(saved_key)
 
-            df = pre_process_data(df)
+        track_session_dataset(dataset_key)
+        if dataset is not None:
+            cube = dataset["cube"]
+            filter_index = dataset["filter_index"]
+            memory_report = dataset["rows"].attrs.get("memory_report") if dataset["rows"] is not None else None
+            if memory_report:
+                st.sidebar.caption(f'Data in memory: {format_bytes(memory_report["before"])} → '
+                                   f'{format_bytes(memory_report["after"])}')
+            coercion_report = dataset["rows"].attrs.get("coercion_report") if dataset["rows"] is not None else None
+            invalid = {column: count for column, count in (coercion_report or {}).get("invalid", {}).items() if count}
+            if invalid:
+                st.sidebar.warning("Cells that are not numbers were left empty: " + ", ".join(
+                    f"{column} ({count:,})" for column, count in invalid.items()))
             # --------------------------- Data Pre-processing -------------------------------
 
             # ----------------------------------- Menu --------------------------------------
@@ -97,70 +491,88 @@ def main():
                                options=["Overview", "Customer Insights", "Product Performance"])
 
             if menu == "Overview":
+                monthly = dataset["monthly"]
                 # -------------------------------- KPIs ----------------------------------
                 kpi_row = st.columns(5)
-                kpi_row[0].plotly_chart(sales_revenue_card(df), use_container_width=True)
-                kpi_row[1].plotly_chart(units_sold_card(df), use_container_width=True)
-                kpi_row[2].plotly_chart(profit_margin_card(df), use_container_width=True)
-                kpi_row[3].plotly_chart(average_discount_rate_card(df), use_container_width=True)
-                kpi_row[4].plotly_chart(average_selling_price_card(df), use_container_width=True)
-
-                row_1 = st.columns((3,2))
                 # ------------------------------- Income & Discounts Analysis --------------------------
-                row_1[0].plotly_chart(income_statement(df), use_container_width=True)
-                row_1[1].plotly_chart(expenses_pie(df), use_container_width=True)
+                row_1 = st.columns((3,2))
+
+                show_charts(dataset_key, [(kpi_row[0], sales_revenue_card),
+                                          (kpi_row[1], units_sold_card),
+                                          (kpi_row[2], profit_margin_card),
+                                          (kpi_row[3], average_discount_rate_card),
+                                          (kpi_row[4], average_selling_price_card),
+                                          (row_1[0], income_statement),
+                                          (row_1[1], expenses_pie)], monthly)
                 # ----------------------------- End Overview --------------------------------
 
             if menu == "Customer Insights":
-                df_0 = df.copy()
                 # ----------------------------- Filters --------------------------------
-                year = st.sidebar.selectbox(label="Year", options=df_0["YEAR"].unique())
-                df_0 = df_0[df_0["YEAR"] == year]
-                months = st.sidebar.multiselect(label="Month", options=df_0["MONTH"].unique(), placeholder="All")
-                if months:
-                    df_0 = df_0[df_0["MONTH"].isin(months)]
-
-                channel = st.sidebar.selectbox(label="Channel", options=df_0["Channel Category"].unique())
-                df_0 = df_0[df_0["Channel Category"] == channel]
+                year = st.sidebar.selectbox(label="Year", options=filter_index.options["YEAR"])
+                months = st.sidebar.multiselect(label="Month", options=filter_index.months_by_year.get(year, []),
+                                                placeholder="All")
+                with timed("filter channel options"):
+                    channels = filter_index.options_for("Channel Category", {"YEAR": year, "MONTH": months})
+                channel = st.sidebar.selectbox(label="Channel", options=channels)
+                with timed("filter customer insights"):
+                    cube_0 = filter_index.take(cube, {"YEAR": year, "MONTH": months, "Channel Category": channel})
+                filters = (year, tuple(months), channel)
+                top_n = st.sidebar.number_input(label="Customers shown", min_value=5, max_value=200,
+                                                value=TOP_CUSTOMERS, step=5)
                 # --------------------------- Product Sales Analysis ------------------------------------
-                st.plotly_chart(rev_by_customer(df_0), use_container_width=True)
+                row_0 = st.container()
                 row_1 = st.columns(2)
-                row_1[0].plotly_chart(avg_disc_given(df_0), use_container_width=True)
-                row_1[1].plotly_chart(clv_plot(df_0), use_container_width=True)
+                show_charts(dataset_key, [(row_0, rev_by_customer),
+                                          (row_1[0], avg_disc_given),
+                                          (row_1[1], clv_plot)], cube_0, filters, top_n=top_n)
+
+                # ----------------------------- All Customers --------------------------------
+                with st.expander("All customers"):
+                    totals = customer_totals(cube_0).sort_values("Revenue", ascending=False, ignore_index=True)
+                    pages = max(1, -(-len(totals) // CUSTOMER_PAGE_ROWS))
+                    page = st.number_input(label=f"Page (of {pages})", min_value=1, max_value=pages, value=1)
+                    start = (page - 1) * CUSTOMER_PAGE_ROWS
+                    st.dataframe(totals.iloc[start:start + CUSTOMER_PAGE_ROWS], use_container_width=True,
+                                 hide_index=True)
 
             if menu == "Product Performance":
-                df_1 = df.copy()
                 # ----------------------------- Filters --------------------------------
-                year = st.sidebar.selectbox(label="Year", options=df["YEAR"].unique())
-                df_1 = df_1[df_1["YEAR"] == year]
-                category = st.sidebar.selectbox(label="Product Category", options=df["Product Category"].unique())
-                df_1 = df_1[df_1["Product Category"] == category]
-                family = st.sidebar.selectbox(label="Product Family", options=df_1["Product Family"].unique())
-                df_1 = df_1[df_1["Product Family"] == family]
+                year = st.sidebar.selectbox(label="Year", options=filter_index.options["YEAR"])
+                category = st.sidebar.selectbox(label="Product Category",
+                                                options=filter_index.options["Product Category"])
+                family = st.sidebar.selectbox(label="Product Family",
+                                              options=filter_index.families_by_category.get((year, category), []))
+                with timed("filter product performance"):
+                    cube_1 = filter_index.take(cube, {"YEAR": year, "Product Category": category,
+                                                      "Product Family": family})
+                filters = (year, category, family)
 
                 # --------------------------- KPIs ------------------------------------
-                avg_list_price = df_1["List Price [CAD]"].mean()
-                total_qty_cold = df_1["QTY [Units]"].sum()
-                total_rev = df_1["Revenue"].sum()
-                total_profit_margin = df_1['Total GM [CAD]'].sum()
-
                 kpi_row = st.columns(4)
-                kpi_row[0].plotly_chart(average_list_price_card(df_1), use_container_width=True)
-                kpi_row[1].plotly_chart(total_prod_qty_card(df_1), use_container_width=True)
-                kpi_row[2].plotly_chart(total_prod_rev_card(df_1), use_container_width=True)
-                kpi_row[3].plotly_chart(total_prod_GM_card(df_1), use_container_width=True)
 
                 # --------------------------- Product Sales Analysis ------------------------------------
 
                 row_1 = st.columns(2)
-                row_1[0].plotly_chart(monthly_rev_gm(df_1), use_container_width=True)
-                row_1[1].plotly_chart(product_performance(df_1), use_container_width=True)
+                show_charts(dataset_key, [(kpi_row[0], average_list_price_card),
+                                          (kpi_row[1], total_prod_qty_card),
+                                          (kpi_row[2], total_prod_rev_card),
+                                          (kpi_row[3], total_prod_GM_card),
+                                          (row_1[0], monthly_rev_gm),
+                                          (row_1[1], product_performance)], cube_1, filters)
 
                 # --------------------------- End Product Performance ------------------------------------
 
         else:
             st.info("Upload data to analyze")
 
+        if profiling:
+            show_timing_panel(stop_recording())
+
+        if pending:
+            # Rerun until the running jobs finish, the page stays interactive in between
+            time.sleep(INGEST_POLL_SECONDS)
+            st.experimental_rerun()
+
 
 if __name__ == main():
     main()
\ No newline at end of file
@@ -0,0 +1,53 @@
+import hashlib
+import hmac
+import time
+
+from pymongo import ASCENDING, MongoClient
+
+# Connections kept per server process, shared by every session
+MONGO_POOL_SIZE = 50
+# How long a verified login stays valid without going back to MongoDB
+SESSION_TTL_SECONDS = 12 * 60 * 60
+
+
+def create_client(con_string, max_pool_size=MONGO_POOL_SIZE):
+    return MongoClient(con_string, maxPoolSize=max_pool_size)
+
+
+def ensure_user_index(users):
+    # Backs the username lookup in check_user, a no-op when the index already exists
+    users.create_index([("username", ASCENDING)])
+
+
+def check_user(users, username, password):
+    user = users.find_one({"username": username}, projection={"_id": 0, "password": 1})
+    if user is None or "password" not in user:
+        return False
+    # Compared as bytes, compare_digest rejects str arguments with non-ASCII characters
+    return hmac.compare_digest(str(user["password"]).encode(), password.encode())
+
+
+def _sign(payload, secret):
+    return hmac.new(secret.encode(), payload.encode(), hashlib.sha256).hexdigest()
+
+
+def make_session_token(username, secret, issued_at=None):
+    issued_at = int(time.time()) if issued_at is None else issued_at
+    payload = f"{username}:{issued_at}"
+    return f"{payload}:{_sign(payload, secret)}"
+
+
+def verify_session_token(token, secret, max_age=SESSION_TTL_SECONDS):
+    # Returns the username a valid, unexpired token was issued for, otherwise None
+    if not token:
+        return None
+    try:
+        username, issued_at, signature = token.rsplit(":", 2)
+        issued_at = int(issued_at)
+    except ValueError:
+        return None
+    if not hmac.compare_digest(signature, _sign(f"{username}:{issued_at}", secret)):
+        return None
+    if time.time() - issued_at > max_age:
+        return None
+    return username
@@ -0,0 +1,89 @@
+from aggregates import *
+
+
+class PandasBackend:
+    """
+    Default aggregation backend over a pre-processed, in-memory DataFrame.
+    """
+
+    name = "pandas"
+
+    def __init__(self, df):
+        self.df = df
+
+    def dataset(self):
+        return build_dataset(self.df)
+
+
+def _quote(name):
+    return '"' + name.replace('"', '""') + '"'
+
+
+def _sum(expression, alias):
+    # SQL SUM over no non-null values is NULL where pandas gives 0
+    return f"COALESCE(SUM({expression}), 0) AS {_quote(alias)}"
+
+
+class DuckDBBackend:
+    """
+    Embedded DuckDB backend. It queries a CSV or Parquet file in place and applies the pre_process_data
+    coercions and derived metrics in a view. Scans are multithreaded, so exports far larger than memory can be
+    aggregated on one node.
+    """
+
+    name = "duckdb"
+
+    def __init__(self, source, threads=None):
+        import duckdb  # optional dependency, only needed for this backend
+
+        self.con = duckdb.connect()
+        if threads:
+            self.con.execute(f"SET threads = {int(threads)}")
+        if str(source).endswith(".parquet"):
+            relation = f"read_parquet('{_escape_path(source)}')"
+        else:
+            relation = f"read_csv_auto('{_escape_path(source)}', header = true)"
+
+        # Every numeric schema column is coerced like coerce_numeric does, text that is not a number becomes NULL
+        coerced = ", ".join(
+            f"TRY_CAST({_quote(column)} AS {'BIGINT' if column in INTEGER_COLUMNS else 'DOUBLE'}) AS {_quote(column)}"
+            for column in NUMERIC_COLUMNS)
+        sd1, sd2, dsp, dpr = (_quote(column) for column in DISCOUNT_AMOUNT_COLUMNS)
+        weighted = ", ".join(f"{_quote(rate)} * \"Revenue\" AS {_quote(name)}"
+                             for name, rate in WEIGHTED_DISCOUNT_COLUMNS.items())
+        self.con.execute(f"CREATE VIEW source AS SELECT * REPLACE ({coerced}) FROM {relation}")
+        self.con.execute(f"""
+            CREATE VIEW sales AS
+            SELECT *,
+                   {sd1} + {sd2} + {dsp} AS "Total Discount",
+                   {sd1} + {sd2} + {dsp} + {dpr} AS "Total Expense",
+                   "Revenue" - ({sd1} + {sd2} + {dsp} + {dpr}) - "Total Cost [CAD]" AS "Net Profit",
+                   {weighted}
+            FROM source
+        """)
+
+    def _query(self, select, group_by):
+        keys = ", ".join(_quote(column) for column in group_by)
+        return self.con.execute(f"SELECT {keys}, {select} FROM sales GROUP BY {keys}").fetchdf()
+
+    def monthly_totals(self):
+        select = ", ".join(_sum(_quote("Total Cost [CAD]" if column == "CoGS" else column), column)
+                           for column in MONTHLY_MEASURES)
+        return self._query(select, ["MONTH"]).set_index("MONTH")
+
+    def cube(self):
+        select = ", ".join([_sum('"Revenue"', "Revenue"), _sum('"Total GM [CAD]"', "Total GM [CAD]"),
+                            _sum('"QTY [Units]"', "QTY [Units]"), 'COUNT(*) AS "Rows"']
+                           + [f"{_sum(_quote(column), column)}, COUNT({_quote(column)}) AS {_quote(column + ' Count')}"
+                              for column in CUBE_MEAN_COLUMNS])
+        return self._query(select, CUBE_DIMENSIONS)
+
+    def dataset(self):
+        return dataset_from_aggregates(finish_monthly(self.monthly_totals()), self.cube())
+
+
+def _escape_path(path):
+    return str(path).replace("'", "''")
+
+
+BACKENDS = {"pandas": PandasBackend, "duckdb": DuckDBBackend}
@@ -0,0 +1,89 @@
+import argparse
+
+import numpy as np
+import pandas as pd
+
+from utils import MONTHS_ORDER
+
+CHANNELS = ["Retail", "Wholesale", "Online", "Distributor"]
+
+
+def _labels(prefix, count):
+    return np.array([f"{prefix} {i}" for i in range(count)], dtype=object)
+
+
+def generate_sales_data(rows, customers=500, categories=5, families_per_category=4, ranges_per_family=5,
+                        years=(2022, 2023), seed=0):
+    # Synthetic export with the exact column schema the dashboard expects
+    rng = np.random.default_rng(seed)
+
+    families = categories * families_per_category
+    product_range = rng.integers(0, families * ranges_per_family, rows)
+    family = product_range // ranges_per_family
+    category = family // families_per_category
+
+    qty = rng.integers(1, 200, rows)
+    list_price = np.round(rng.uniform(5, 500, rows), 2)
+    gross = qty * list_price
+    sd1_rate = np.round(rng.uniform(0, 0.10, rows), 3)
+    sd2_rate = np.round(rng.uniform(0, 0.05, rows), 3)
+    dsp_rate = np.round(rng.uniform(0, 0.05, rows) * (rng.random(rows) < 0.3), 3)
+    dpr_rate = np.round(rng.uniform(0, 0.08, rows) * (rng.random(rows) < 0.2), 3)
+    revenue = np.round(gross * (1 - sd1_rate - sd2_rate - dsp_rate - dpr_rate), 2)
+    unit_gm = np.round(rng.uniform(5, 60, rows), 1)
+    total_gm = np.round(revenue * unit_gm / 100, 2)
+
+    return pd.DataFrame({
+        "MONTH": np.asarray(MONTHS_ORDER, dtype=object)[rng.integers(0, 12, rows)],
+        "YEAR": np.asarray(years)[rng.integers(0, len(years), rows)],
+        "Channel Category": np.asarray(CHANNELS, dtype=object)[rng.integers(0, len(CHANNELS), rows)],
+        "Customer Name": _labels("Customer", customers)[rng.integers(0, customers, rows)],
+        "Product Category": _labels("Category", categories)[category],
+        "Product Family": _labels("Family", families)[family],
+        "Product Range": _labels("Range", families * ranges_per_family)[product_range],
+        "QTY [Units]": qty,
+        "List Price [CAD]": list_price,
+        "Revenue": revenue,
+        "Total Cost [CAD]": np.round(revenue - total_gm, 2),
+        "Total GM [CAD]": total_gm,
+        "Unit GM [%]": unit_gm,
+        "Standard Discount [SD1 %]": sd1_rate,
+        "Standard Discount [SD2 %]": sd2_rate,
+        "Special Discount [DSP %]": dsp_rate,
+        "Promo Campaign [DPR%]": dpr_rate,
+        "Standard Discount [SD1][CAD]": np.round(gross * sd1_rate, 2),
+        "Standard Discount [SD2][CAD]": np.round(gross * sd2_rate, 2),
+        "Special Discount [DSP][CAD]": np.round(gross * dsp_rate, 2),
+        "Promo Campaign [DPR][CAD]": np.round(gross * dpr_rate, 2),
+        "Rebates [DREB][CAD]": np.round(revenue * rng.uniform(0, 0.03, rows), 2),
+    })
+
+
+def add_cardinality_arguments(parser):
+    # Shared by this script and the benchmark harness
+    parser.add_argument("--customers", type=int, default=500)
+    parser.add_argument("--categories", type=int, default=5, help="Product categories")
+    parser.add_argument("--families-per-category", type=int, default=4)
+    parser.add_argument("--ranges-per-family", type=int, default=5)
+    parser.add_argument("--years", type=int, nargs="+", default=[2022, 2023])
+
+
+def cardinalities(args):
+    return {"customers": args.customers, "categories": args.categories,
+            "families_per_category": args.families_per_category, "ranges_per_family": args.ranges_per_family,
+            "years": tuple(args.years)}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Write a synthetic sales export")
+    parser.add_argument("output", help="CSV or XLSX file to write")
+    parser.add_argument("--rows", type=int, default=10_000)
+    add_cardinality_arguments(parser)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    df = generate_sales_data(args.rows, seed=args.seed, **cardinalities(args))
+    if args.output.endswith(".xlsx"):
+        df.to_excel(args.output, index=False)
+    else:
+        df.to_csv(args.output, index=False)
@@ -0,0 +1,145 @@
+import argparse
+import json
+import os
+import tempfile
+import time
+import tracemalloc
+
+import pandas as pd
+
+from aggregates import build_dataset, build_dataset_from_chunks
+from benchmarks.generate import add_cardinality_arguments, cardinalities, generate_sales_data
+from ingest import DASHBOARD_COLUMNS, excel_sheets, load_excel
+from plots.plots import *
+from utils import pre_process_data, read_csv_chunks
+
+SIZES = {"10k": 10_000, "1M": 1_000_000, "10M": 10_000_000}
+
+# Writing a workbook is slow and Excel sheets end at 1,048,576 rows, the Excel paths use at most this many rows
+EXCEL_ROWS = 100_000
+XLSX = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), "baseline.json")
+
+# A step is reported as a regression when it is this much slower (or larger) than the baseline
+REGRESSION_FACTOR = 1.25
+
+OVERVIEW_BUILDERS = [sales_revenue_card, units_sold_card, profit_margin_card, average_discount_rate_card,
+                     average_selling_price_card, income_statement, expenses_pie]
+CUBE_BUILDERS = [rev_by_customer, avg_disc_given, clv_plot, average_list_price_card, total_prod_qty_card,
+                 total_prod_rev_card, total_prod_GM_card, monthly_rev_gm, product_performance]
+
+
+def measure(func, *args):
+    # Wall time in seconds and peak traced memory in bytes, NumPy buffers are reported to tracemalloc.
+    # Tracing slows allocation-heavy code several times over, so memory is traced in a separate run on copies
+    # of the input frames, in case a step changes them in place, and only the untraced run is timed.
+    copies = [arg.copy() if isinstance(arg, pd.DataFrame) else arg for arg in args]
+    tracemalloc.start()
+    func(*copies)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    del copies
+
+    start = time.perf_counter()
+    result = func(*args)
+    elapsed = time.perf_counter() - start
+    return result, {"seconds": round(elapsed, 4), "peak_bytes": peak}
+
+
+def warm_up():
+    # First Plotly figure construction pays for lazy imports and validator setup, keep it out of the timings
+    dataset = build_dataset(pre_process_data(generate_sales_data(1_000)))
+    for builder in OVERVIEW_BUILDERS:
+        builder(dataset["monthly"])
+    for builder in CUBE_BUILDERS:
+        builder(dataset["cube"])
+
+
+# The ingestion paths of the app, from the uploaded file to the dataset the charts read
+
+
+def ingest_csv(path, keep_rows=True):
+    # Pandas backend: schema-checked chunked read, rows kept unless streaming
+    with open(path, "rb") as f:
+        return build_dataset_from_chunks(read_csv_chunks(f), keep_rows=keep_rows)
+
+
+def ingest_csv_streaming(path):
+    return ingest_csv(path, keep_rows=False)
+
+
+def ingest_excel(path, cache_dir=None):
+    # First load of a workbook converts the sheet to Parquet, later loads (`cache_dir` given) read the Parquet file
+    with open(path, "rb") as f, tempfile.TemporaryDirectory() as tmp:
+        rows = load_excel(f, XLSX, "benchmark", excel_sheets(f, XLSX)[0], DASHBOARD_COLUMNS, cache_dir or tmp)
+        return build_dataset(pre_process_data(rows))
+
+
+def run_size(rows, options):
+    results = {}
+    raw = generate_sales_data(rows, **options)
+    with tempfile.TemporaryDirectory() as tmp:
+        csv_path, xlsx_path = os.path.join(tmp, "sales.csv"), os.path.join(tmp, "sales.xlsx")
+        raw.to_csv(csv_path, index=False)
+        raw.iloc[:EXCEL_ROWS].to_excel(xlsx_path, index=False)
+        del raw
+        dataset, results["ingest_csv"] = measure(ingest_csv, csv_path)
+        _, results["ingest_csv_streaming"] = measure(ingest_csv_streaming, csv_path)
+        _, results["ingest_excel"] = measure(ingest_excel, xlsx_path)
+        cache_dir = os.path.join(tmp, "parquet")
+        ingest_excel(xlsx_path, cache_dir)
+        _, results["ingest_excel_cached"] = measure(ingest_excel, xlsx_path, cache_dir)
+
+    for builder in OVERVIEW_BUILDERS:
+        _, results[builder.__name__] = measure(builder, dataset["monthly"])
+    for builder in CUBE_BUILDERS:
+        _, results[builder.__name__] = measure(builder, dataset["cube"])
+    return results
+
+
+def compare(results, baseline):
+    regressions = []
+    for size, steps in results.items():
+        for step, current in steps.items():
+            reference = baseline.get(size, {}).get(step)
+            if reference is None:
+                continue
+            for metric in ["seconds", "peak_bytes"]:
+                if reference[metric] and current[metric] > reference[metric] * REGRESSION_FACTOR:
+                    regressions.append(f"{size} {step} {metric}: {reference[metric]} -> {current[metric]}")
+    return regressions
+
+
+def print_results(results):
+    for size, steps in results.items():
+        print(f"\n{size}")
+        for step, current in steps.items():
+            print(f"  {step:<28} {current['seconds']:>9.4f} s {current['peak_bytes'] / 1024 ** 2:>10.1f} MB")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Time the ingestion paths and every figure builder")
+    parser.add_argument("--sizes", nargs="+", default=["10k", "1M"], choices=list(SIZES))
+    add_cardinality_arguments(parser)
+    parser.add_argument("--output", help="Write the results to this JSON file")
+    parser.add_argument("--save-baseline", action="store_true", help=f"Store the results in {BASELINE_PATH}")
+    args = parser.parse_args()
+
+    warm_up()
+    results = {size: run_size(SIZES[size], cardinalities(args)) for size in args.sizes}
+    print_results(results)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.save_baseline:
+        with open(BASELINE_PATH, "w") as f:
+            json.dump(results, f, indent=2)
+    elif os.path.exists(BASELINE_PATH):
+        with open(BASELINE_PATH) as f:
+            regressions = compare(results, json.load(f))
+        print("\nRegressions against baseline:" if regressions else "\nNo regressions against baseline")
+        for regression in regressions:
+            print(f"  {regression}")
+        if regressions:
+            raise SystemExit(1)
@@ -0,0 +1,206 @@
+import hashlib
+import os
+import shutil
+import threading
+import time
+from collections import OrderedDict
+
+import pandas as pd
+
+
+def content_hash(data):
+    # blake2b is considerably faster than sha256 on large uploads and collisions are not a concern here
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def frame_nbytes(df):
+    # Memory-mapped columns live in the shared page cache, not in this process
+    return int(df.memory_usage(deep=True).sum()) - df.attrs.get("mapped_bytes", 0)
+
+
+def dataset_nbytes(dataset):
+    # A dataset is a dict of DataFrames (raw rows and their aggregates) plus lookup structures exposing `nbytes`
+    nbytes = 0
+    for value in dataset.values():
+        if isinstance(value, pd.DataFrame):
+            nbytes += frame_nbytes(value)
+        elif value is not None:
+            nbytes += value.nbytes
+    return nbytes
+
+
+# Temporary files and directories of interrupted writes older than this are removed by prune_directory
+STALE_TMP_SECONDS = 60 * 60
+
+
+def _entry_bytes(path):
+    if not os.path.isdir(path):
+        return os.path.getsize(path)
+    return sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(path) for name in names)
+
+
+def _remove(path):
+    if os.path.isdir(path):
+        shutil.rmtree(path, ignore_errors=True)
+    else:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def prune_directory(directory, max_bytes, keep=()):
+    # Caps a disk cache directory at `max_bytes`, removing its entries (files or directories) least recently used
+    # first. Readers touch an entry's mtime when they reuse it. Leftovers of interrupted writes (".tmp-*" and
+    # "*.tmp") are removed once stale. Entries in `keep` are never removed. Several processes may prune the same
+    # directory, entries vanishing meanwhile are skipped. Returns the number of removed entries.
+    try:
+        names = os.listdir(directory)
+    except FileNotFoundError:
+        return 0
+    keep = {os.path.abspath(path) for path in keep}
+    now, entries, removed = time.time(), [], 0
+    for name in names:
+        path = os.path.join(directory, name)
+        try:
+            mtime = os.stat(path).st_mtime
+            if name.startswith(".tmp-") or name.endswith(".tmp"):
+                if now - mtime > STALE_TMP_SECONDS:
+                    _remove(path)
+                    removed += 1
+                continue
+            entries.append((mtime, path, _entry_bytes(path)))
+        except FileNotFoundError:
+            continue
+    total = sum(nbytes for _, _, nbytes in entries)
+    for _, path, nbytes in sorted(entries):
+        if total <= max_bytes:
+            break
+        if os.path.abspath(path) in keep:
+            continue
+        _remove(path)
+        total -= nbytes
+        removed += 1
+    return removed
+
+
+class DatasetRegistry:
+    """
+    Process-wide registry of pre-processed datasets keyed by content hash, shared by all sessions.
+    Sessions acquire the dataset they display and release it when they switch datasets or end. Once the resident
+    size exceeds `max_bytes`, unreferenced datasets are evicted least-recently-used first, then referenced ones.
+    Evicted datasets are handed to `spill` and brought back by `reload` on their next access.
+    """
+
+    def __init__(self, max_bytes, spill=None, reload=None):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.reloads = 0
+        self.evictions = 0
+        self._spill = spill
+        self._reload = reload
+        self._entries = OrderedDict()
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            if key in self._entries:
+                self.hits += 1
+                self._entries.move_to_end(key)
+                return self._entries[key][0]
+        dataset = self._reload(key) if self._reload is not None else None
+        with self._lock:
+            if dataset is None:
+                self.misses += 1
+                return None
+            self.reloads += 1
+        return self.put(key, dataset)
+
+    def put(self, key, dataset):
+        nbytes = dataset_nbytes(dataset)
+        with self._lock:
+            if key in self._entries:
+                self.current_bytes -= self._entries.pop(key)[1]
+            self._entries[key] = (dataset, nbytes)
+            self.current_bytes += nbytes
+            evicted = self._evict()
+        # Spilled outside the lock, writing a large dataset must not block other sessions
+        if self._spill is not None:
+            for evicted_key, evicted_dataset in evicted:
+                self._spill(evicted_key, evicted_dataset)
+        return dataset
+
+    def _evict(self):
+        evicted = []
+        while self.current_bytes > self.max_bytes and self._entries:
+            referenced = set(self._sessions.values())
+            key = next((key for key in self._entries if key not in referenced), next(iter(self._entries)))
+            dataset, nbytes = self._entries.pop(key)
+            self.current_bytes -= nbytes
+            self.evictions += 1
+            evicted.append((key, dataset))
+        return evicted
+
+    def acquire(self, session_id, key):
+        # A session displays one dataset at a time, acquiring a new one releases the previous
+        with self._lock:
+            self._sessions[session_id] = key
+
+    def release(self, session_id):
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+    def prune(self, is_alive):
+        # Drops the references of sessions that ended without releasing their dataset
+        with self._lock:
+            for session_id in [session_id for session_id in self._sessions if not is_alive(session_id)]:
+                del self._sessions[session_id]
+
+    def stats(self):
+        with self._lock:
+            return {"datasets": len(self._entries), "resident_bytes": self.current_bytes,
+                    "sessions": len(self._sessions), "hits": self.hits, "misses": self.misses,
+                    "reloads": self.reloads, "evictions": self.evictions}
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class FigureCache:
+    """
+    Process-wide LRU cache of built Plotly figures keyed by (dataset key, plot function, filter tuple).
+    Figures are kept as built objects since `st.plotly_chart` serializes them itself, a hit skips both
+    the aggregation and the figure construction. Cached figures are shared and must not be mutated.
+    """
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_or_build(self, key, build):
+        with self._lock:
+            if key in self._entries:
+                self.hits += 1
+                self._entries.move_to_end(key)
+                return self._entries[key]
+            self.misses += 1
+        # Built outside the lock so slow figures don't block other sessions
+        fig = build()
+        with self._lock:
+            self._entries[key] = fig
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return fig
+
+    def stats(self):
+        return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
@@ -0,0 +1,87 @@
+import numpy as np
+import pandas as pd
+
+from utils import MONTHS_ORDER
+
+FILTER_COLUMNS = ["YEAR", "MONTH", "Channel Category", "Product Category", "Product Family"]
+
+# Columns whose options follow a fixed order rather than the sorted values, unknown values go last
+OPTION_ORDERS = {"MONTH": MONTHS_ORDER}
+
+
+def option_order(column, values):
+    # Positions that put `values` (sorted) in the display order of `column`
+    order = OPTION_ORDERS.get(column)
+    if order is None:
+        return np.arange(len(values))
+    rank = {value: position for position, value in enumerate(order)}
+    return np.array(sorted(range(len(values)), key=lambda i: rank.get(values[i], len(rank))), dtype=np.intp)
+
+
+class FilterIndex:
+    """
+    Maps every value of the sidebar filter columns to the row positions holding it, so a filter combination is
+    resolved with index intersections and one `take` instead of repeated boolean masks over the frame.
+    """
+
+    def __init__(self, frame, columns=FILTER_COLUMNS):
+        self.columns = columns
+        self.positions = {}
+        self.options = {}
+        self._codes = {}
+        for column in columns:
+            codes, uniques = pd.factorize(frame[column], sort=True)
+            if column in OPTION_ORDERS:
+                # Codes are renumbered so that code order is display order, options_for relies on it
+                display = option_order(column, uniques)
+                recode = np.empty(len(display) + 1, dtype=codes.dtype)
+                recode[display] = np.arange(len(display))
+                recode[-1] = -1
+                codes, uniques = recode[codes], uniques[display]
+            order = np.argsort(codes, kind="stable")
+            bounds = np.searchsorted(codes[order], np.arange(len(uniques) + 1))
+            # NaN is factorized to -1 and sorts first, it is left out of the index like any unselectable value
+            self.positions[column] = {value: order[bounds[i]:bounds[i + 1]] for i, value in enumerate(uniques)}
+            self.options[column] = list(uniques)
+            self._codes[column] = codes
+
+        # Cascading option lists for the dependent selectors
+        self.months_by_year = self._cascade(frame, ["YEAR"], "MONTH")
+        self.families_by_category = self._cascade(frame, ["YEAR", "Product Category"], "Product Family")
+        self.nbytes = sum(codes.nbytes for codes in self._codes.values()) + sum(
+            rows.nbytes for index in self.positions.values() for rows in index.values())
+
+    @staticmethod
+    def _cascade(frame, parents, child):
+        cascade = {}
+        pairs = frame.groupby(parents + [child], observed=True).size().index
+        for key in pairs:
+            parent = key[0] if len(parents) == 1 else tuple(key[:-1])
+            cascade.setdefault(parent, []).append(key[-1])
+        for parent, values in cascade.items():
+            cascade[parent] = [values[i] for i in option_order(child, values)]
+        return cascade
+
+    def rows(self, filters):
+        # `filters` maps column name to a value, a list value matches any of its items and an empty list matches all
+        selected = None
+        for column, value in filters.items():
+            index = self.positions[column]
+            if isinstance(value, (list, tuple)):
+                if not value:
+                    continue
+                matches = np.sort(np.concatenate([index.get(item, np.empty(0, dtype=np.intp)) for item in value]))
+            else:
+                matches = index.get(value, np.empty(0, dtype=np.intp))
+            selected = matches if selected is None else np.intersect1d(selected, matches, assume_unique=True)
+        if selected is None:
+            return np.arange(len(self._codes[self.columns[0]]))
+        return selected
+
+    def options_for(self, column, filters):
+        # Values of `column` present in the rows matching `filters`
+        codes = np.unique(self._codes[column][self.rows(filters)])
+        return [self.options[column][code] for code in codes if code >= 0]
+
+    def take(self, frame, filters):
+        return frame.take(self.rows(filters))
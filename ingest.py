@@ -0,0 +1,137 @@
+import hashlib
+import os
+
+import pandas as pd
+from pandas.io.parsers import TextParser
+
+from instrumentation import instrument
+from utils import SCHEMA_COLUMNS, check_columns
+
+# Columns the dashboards read, the default column selection for Excel uploads
+DASHBOARD_COLUMNS = SCHEMA_COLUMNS
+
+# Rows between two progress reports while a sheet is read
+PROGRESS_ROWS = 10_000
+
+try:
+    from python_calamine import CalamineWorkbook
+except ImportError:  # optional, openpyxl read-only streaming is used without it
+    CalamineWorkbook = None
+
+
+def excel_reader(file_type):
+    # calamine (Rust) reads both XLS and XLSX and is much faster than the pure Python readers
+    if CalamineWorkbook is not None:
+        return "calamine"
+    if file_type == "application/vnd.ms-excel":
+        return "xlrd"
+    return "openpyxl"
+
+
+def _rewind(file):
+    file.seek(0)
+    return file
+
+
+def excel_sheets(file, file_type):
+    reader = excel_reader(file_type)
+    if reader == "calamine":
+        return CalamineWorkbook.from_filelike(_rewind(file)).sheet_names
+    if reader == "openpyxl":
+        import openpyxl
+        workbook = openpyxl.load_workbook(_rewind(file), read_only=True)
+        try:
+            return workbook.sheetnames
+        finally:
+            workbook.close()
+    return pd.ExcelFile(_rewind(file)).sheet_names
+
+
+def _cell(value):
+    # Excel stores every number as a float, integral ones become ints as in pd.read_excel
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    return value
+
+
+def _rows(file, file_type, sheet):
+    # Yields the sheet row by row as lists of values, without building a workbook object model
+    reader = excel_reader(file_type)
+    if reader == "calamine":
+        for row in CalamineWorkbook.from_filelike(_rewind(file)).get_sheet_by_name(sheet).iter_rows():
+            yield [_cell(value) for value in row]
+    elif reader == "openpyxl":
+        import openpyxl
+        workbook = openpyxl.load_workbook(_rewind(file), read_only=True, data_only=True)
+        try:
+            for row in workbook[sheet].iter_rows(values_only=True):
+                yield [_cell(value) for value in row]
+        finally:
+            workbook.close()
+    else:
+        for row in pd.read_excel(_rewind(file), sheet_name=sheet, header=None).itertuples(index=False):
+            yield [_cell(value) for value in row]
+
+
+def excel_header(file, file_type, sheet):
+    return [str(value) for value in next(_rows(file, file_type, sheet), ()) if value is not None]
+
+
+def _to_parquet_safe(df):
+    # Excel columns can mix numbers and text (e.g. "n/a" in a discount column), Parquet needs one type per column
+    for column in df.columns:
+        if df[column].dtype == object:
+            values = df[column].dropna()
+            if values.map(type).nunique() > 1:
+                df[column] = df[column].where(df[column].isna(), df[column].astype(str))
+    return df
+
+
+def _reported(rows, progress):
+    for count, row in enumerate(rows, 1):
+        if count % PROGRESS_ROWS == 0:
+            progress(PROGRESS_ROWS)
+        yield row
+
+
+@instrument
+def read_excel_sheet(file, file_type, sheet, progress=None):
+    # TextParser is the parser behind pd.read_excel: same NA strings, numeric text and blank line handling.
+    # The header row is checked against the schema before any other row is read.
+    rows = _rows(file, file_type, sheet)
+    header = next(rows, None)
+    if header is None:
+        return pd.DataFrame()
+    check_columns([value for value in header if value is not None])
+    if progress is not None:
+        rows = _reported(rows, progress)
+    rows = [["" if value is None else value for value in row] for row in [header, *rows]]
+    return TextParser(rows, header=0).read()
+
+
+def parquet_cache_path(cache_dir, content_key, sheet):
+    sheet_key = hashlib.blake2b(sheet.encode(), digest_size=8).hexdigest()
+    return os.path.join(cache_dir, f"{content_key}-{sheet_key}.parquet")
+
+
+@instrument
+def convert_excel(file, file_type, content_key, sheet, cache_dir, progress=None):
+    # Each sheet is converted once into a Parquet file keyed by workbook content, it outlives server restarts
+    path = parquet_cache_path(cache_dir, content_key, sheet)
+    try:
+        # Marks the conversion as recently used for the size cap of the cache directory
+        os.utime(path)
+        return path
+    except FileNotFoundError:
+        pass
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    _to_parquet_safe(read_excel_sheet(file, file_type, sheet, progress)).to_parquet(tmp_path, index=False)
+    os.replace(tmp_path, path)
+    return path
+
+
+def load_excel(file, file_type, content_key, sheet, columns, cache_dir, progress=None):
+    # Later loads read only the requested columns from the Parquet file
+    path = convert_excel(file, file_type, content_key, sheet, cache_dir, progress)
+    return pd.read_parquet(path, columns=columns)
@@ -0,0 +1,101 @@
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+logger = logging.getLogger("aitionics.timing")
+
+# Timings are recorded per script thread, only while recording is switched on for the current rerun
+_state = threading.local()
+
+
+def start_recording():
+    _state.records = []
+
+
+def stop_recording():
+    records = getattr(_state, "records", None) or []
+    _state.records = None
+    return records
+
+
+@contextmanager
+def timed(step):
+    records = getattr(_state, "records", None)
+    if records is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        records.append({"step": step, "seconds": time.perf_counter() - start})
+
+
+def propagate(func):
+    # Wraps `func` to run on a worker thread with the calling thread's recording state
+    records = getattr(_state, "records", None)
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        _state.records = records
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _state.records = None
+    return wrapper
+
+
+def instrument(func):
+    # Disabled cost is one attribute lookup per call
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        if getattr(_state, "records", None) is None:
+            return func(*args, **kwargs)
+        with timed(func.__name__):
+            return func(*args, **kwargs)
+    return wrapper
+
+
+def record_payload(step, fig):
+    # Serializes the figure once more to measure its payload, so it only runs while recording
+    records = getattr(_state, "records", None)
+    if records is None:
+        return
+    start = time.perf_counter()
+    payload = fig.to_json()
+    records.append({"step": f"{step} serialize", "seconds": time.perf_counter() - start,
+                    "bytes": len(payload.encode())})
+
+
+def log_records(records):
+    logger.info(json.dumps({"timestamp": time.time(), "records": records}))
+
+
+def _escape_label(value):
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def write_prometheus(path, records):
+    # Prometheus text exposition format, written atomically for the node exporter textfile collector
+    # A step recorded several times in one rerun is reported once, with its durations summed
+    seconds, payloads = {}, {}
+    for record in records:
+        seconds[record["step"]] = seconds.get(record["step"], 0) + record["seconds"]
+        if "bytes" in record:
+            payloads[record["step"]] = payloads.get(record["step"], 0) + record["bytes"]
+
+    lines = ["# HELP aitionics_step_seconds Duration of a dashboard step in the last recorded rerun.",
+             "# TYPE aitionics_step_seconds gauge"]
+    lines += [f'aitionics_step_seconds{{step="{_escape_label(step)}"}} {value:.6f}' for step, value in seconds.items()]
+    lines += ["# HELP aitionics_figure_payload_bytes Serialized figure size in the last recorded rerun.",
+              "# TYPE aitionics_figure_payload_bytes gauge"]
+    lines += [f'aitionics_figure_payload_bytes{{step="{_escape_label(step)}"}} {value}'
+              for step, value in payloads.items()]
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        f.write("\n".join(lines) + "\n")
+    os.replace(tmp_path, path)
@@ -0,0 +1,64 @@
+import threading
+
+
+class IngestJob:
+    """
+    Progress and outcome of one upload being ingested on the worker pool. The worker reports rows and bytes read
+    and, where the file is aggregated chunk by chunk, the dataset of the chunks read so far or a sampled preview.
+    """
+
+    def __init__(self, name, total_bytes):
+        self.name = name
+        self.total_bytes = total_bytes
+        self.rows = 0
+        self.bytes = 0
+        self.partial = None
+        self.estimate = None
+        self.future = None
+
+    def report(self, rows=0, bytes_read=None, partial=None, estimate=None):
+        # Called from the worker thread only, sessions just read the attributes. `estimate` marks `partial` as
+        # an approximate preview of the whole file rather than the exact figures of the part read so far.
+        self.rows += rows
+        if bytes_read is not None:
+            self.bytes = bytes_read
+        if partial is not None:
+            self.partial = partial
+            self.estimate = estimate
+
+    def fraction(self):
+        if self.done():
+            return 1.0
+        return min(self.bytes / self.total_bytes, 1.0) if self.total_bytes else 0.0
+
+    def done(self):
+        return self.future.done()
+
+    def result(self):
+        # Re-raises the worker's exception
+        return self.future.result()
+
+
+class JobRegistry:
+    """
+    Process-wide ingestion jobs keyed by dataset key. Jobs outlive the rerun that started them, every session
+    asking for the same key while it runs gets the same job.
+    """
+
+    def __init__(self, pool):
+        self.pool = pool
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def submit(self, key, name, total_bytes, work):
+        # `work(job)` runs on the pool and returns the finished dataset
+        with self._lock:
+            if key not in self._jobs:
+                job = IngestJob(name, total_bytes)
+                job.future = self.pool.submit(work, job)
+                self._jobs[key] = job
+            return self._jobs[key]
+
+    def pop(self, key):
+        with self._lock:
+            return self._jobs.pop(key, None)
@@ -0,0 +1,70 @@
+import copy
+
+import numpy as np
+import plotly
+import plotly.graph_objects as go
+import plotly.io as pio
+
+# Values are sent rounded to what hover labels and axes display
+DISPLAY_DECIMALS = 2
+
+# Scatter traces with at least this many points are drawn with WebGL (Plotly has no WebGL bar trace)
+WEBGL_MIN_POINTS = 1_000
+
+# Plotly 6 serializes NumPy arrays as typed binary arrays, there float32 halves the payload of a float column.
+# Values from this magnitude on would lose cents in float32 and stay float64.
+TYPED_ARRAYS = int(plotly.__version__.split(".")[0]) >= 6
+FLOAT32_EXACT_LIMIT = 2 ** 24 / 10 ** DISPLAY_DECIMALS
+
+DATA_ATTRIBUTES = ["x", "y", "values", "customdata"]
+
+
+def compact_array(values):
+    array = np.asarray(values)
+    if array.dtype.kind != "f":
+        return values
+    # Rounded in float64: float32 aggregates would otherwise be written out with their full binary expansion
+    array = np.round(array.astype(np.float64), DISPLAY_DECIMALS)
+    if TYPED_ARRAYS and not (np.abs(array) >= FLOAT32_EXACT_LIMIT).any():
+        array = array.astype(np.float32)
+    return array
+
+
+# Lean templates per template name and set of trace types, built once per process
+_LEAN_TEMPLATES = {}
+
+def lean_template(trace_types):
+    # The default template carries defaults for every trace type, only those of the traces present are kept.
+    # The chart builders all use the default template.
+    key = (pio.templates.default, trace_types)
+    if key not in _LEAN_TEMPLATES:
+        template = pio.templates[pio.templates.default]
+        data = {trace_type: template.data[trace_type] for trace_type in trace_types if template.data[trace_type]}
+        _LEAN_TEMPLATES[key] = go.layout.Template(layout=template.layout, data=data).to_plotly_json()
+    return _LEAN_TEMPLATES[key]
+
+
+def to_webgl(trace):
+    # `trace` is a property dict. Only the long scatter traces are converted and validated again, which drops the
+    # properties Scattergl does not support (e.g. spline lines).
+    if trace["type"] == "scatter" and trace.get("x") is not None and len(trace["x"]) >= WEBGL_MIN_POINTS:
+        trace = dict(trace, type="scattergl")
+        return go.Scattergl(trace, skip_invalid=True).to_plotly_json()
+    return trace
+
+
+def compact_figure(fig):
+    # Returns a copy of `fig` with a lean template, rounded (and where supported typed) data arrays and WebGL
+    # scatter traces for long series. Built figures are cached and shared, so `fig` itself is left untouched.
+    # The copy is made from property dicts (to_plotly_json copies) and not validated again: re-validating
+    # every trace and the layout cost more than building the figure.
+    traces = []
+    for trace in fig.data:
+        trace = to_webgl(trace.to_plotly_json())
+        for attribute in DATA_ATTRIBUTES:
+            if trace.get(attribute) is not None:
+                trace[attribute] = compact_array(trace[attribute])
+        traces.append(trace)
+    layout = {name: copy.deepcopy(value) for name, value in fig.layout._props.items() if name != "template"}
+    layout["template"] = lean_template(frozenset(trace["type"] for trace in traces))
+    return go.Figure(data=traces, layout=layout, _validate=False)
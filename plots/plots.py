@@ -3,26 +3,25 @@ import plotly.express as px
 from plotly.subplots import make_subplots
 import plotly.graph_objects as go
 from utils import *
+from aggregates import *
 
 colors = ["#2a9d8f", "#264653", "#e9c46a", "#f4a261", "#e76f51", "#ef233c", "#f6bd60", "#84a59d", "#f95738"]
 # colors = ["#880d1e", "#f26a8d", "#dd2d4a", "#f49cbb", "#cbeef3", "#880d1e"]
 
 
-def sales_revenue_card(df):
-    sales_by_month = df.groupby("MONTH")["Revenue"].sum()
-    sales_by_month = sales_by_month.reindex(MONTHS_ORDER).reset_index()
+def sales_revenue_card(monthly):
     fig = go.Figure(
         go.Indicator(
             mode="number",
-            value=sales_by_month["Revenue"].sum(),
+            value=monthly["Revenue"].sum(),
             number={"prefix": "$"},
             title={"text": "Total Sales Revenue", "font": {"size": 20}},
             domain={'y': [0, 1], 'x': [0.25, 0.75]}
         ))
 
     fig.add_trace(go.Scatter(
-        x=sales_by_month["MONTH"],
-        y=sales_by_month["Revenue"],
+        x=monthly["MONTH"],
+        y=monthly["Revenue"],
         mode="lines",
         fill='tozeroy',
         name="Total Revenue",
@@ -34,21 +33,19 @@ def sales_revenue_card(df):
     return fig
 
 
-def units_sold_card(df):
-    qty_sold = df.groupby("MONTH")["QTY [Units]"].sum()
-    qty_sold = qty_sold.reindex(MONTHS_ORDER).reset_index()
+def units_sold_card(monthly):
     fig = go.Figure(
         go.Indicator(
             mode="number",
-            value=qty_sold["QTY [Units]"].sum(),
+            value=monthly["QTY [Units]"].sum(),
             number={"suffix": " units"},
             title={"text": "Total Units Sold", "font": {"size": 20}},
             domain={'y': [0, 1], 'x': [0.25, 0.75]}
         ))
 
     fig.add_trace(go.Scatter(
-        x=qty_sold["MONTH"],
-        y=qty_sold["QTY [Units]"],
+        x=monthly["MONTH"],
+        y=monthly["QTY [Units]"],
         mode="lines",
         fill='tozeroy',
         name="Qty Sold",
@@ -60,14 +57,11 @@ def units_sold_card(df):
     return fig
 
 
-def profit_margin_card(df):
-    monthly_financials = df.groupby("MONTH").agg({"Revenue": "sum", "Total GM [CAD]": "sum"})
-    monthly_financials = monthly_financials.reindex(MONTHS_ORDER).reset_index()
-    monthly_financials['Profit Margin'] = (monthly_financials['Total GM [CAD]'] / monthly_financials['Revenue']) * 100
-    total_revenue = monthly_financials['Revenue'].sum()
-    total_gross_margin = monthly_financials['Total GM [CAD]'].sum()
+def profit_margin_card(monthly):
+    total_revenue = monthly['Revenue'].sum()
+    total_gross_margin = monthly['Total GM [CAD]'].sum()
     overall_profit_margin = (total_gross_margin / total_revenue) * 100
-    delta_ref = overall_profit_margin * 100 - np.mean(monthly_financials['Profit Margin'])
+    delta_ref = overall_profit_margin * 100 - np.mean(monthly['Profit Margin'])
     fig = go.Figure(
         go.Indicator(
             mode="number+delta",
@@ -80,8 +74,8 @@ def profit_margin_card(df):
         ))
 
     fig.add_trace(go.Scatter(
-        x=monthly_financials["MONTH"],
-        y=monthly_financials["Profit Margin"],
+        x=monthly["MONTH"],
+        y=monthly["Profit Margin"],
         mode="lines",
         fill='tozeroy',
         name="Profit Margin",
@@ -95,34 +89,13 @@ def profit_margin_card(df):
     return fig
 
 
-def average_discount_rate_card(df):
-    # Calculate the weighted discount rates, assuming discounts are stored as proportions (e.g., 20% is stored as 0.20)
-    df['Weighted SD1'] = df['Standard Discount [SD1 %]'] * df['Revenue']
-    df['Weighted SD2'] = df['Standard Discount [SD2 %]'] * df['Revenue']
-    df['Weighted DSP'] = df['Special Discount [DSP %]'] * df['Revenue']
-    df['Weighted DPR'] = df['Promo Campaign [DPR%]'] * df['Revenue']
-
-    # Aggregate these weighted discounts and sum of revenue by month
-    monthly_discounts = df.groupby('MONTH').agg({
-        'Weighted SD1': 'sum',
-        'Weighted SD2': 'sum',
-        'Weighted DSP': 'sum',
-        'Weighted DPR': 'sum',
-        'Revenue': 'sum'
-    })
-    monthly_discounts = monthly_discounts.reindex(MONTHS_ORDER).reset_index()
-
-    # Calculate the overall average discount rate by month
-    monthly_discounts['Avg Discount Rate'] = (
-            monthly_discounts[['Weighted SD1', 'Weighted SD2', 'Weighted DSP', 'Weighted DPR']].sum(axis=1)
-            / monthly_discounts['Revenue'])
-
+def average_discount_rate_card(monthly):
     # Calculate the overall average discount rate
-    total_discounts = monthly_discounts[['Weighted SD1', 'Weighted SD2', 'Weighted DSP', 'Weighted DPR']].sum().sum()
-    total_revenue = monthly_discounts['Revenue'].sum()
+    total_discounts = monthly[['Weighted SD1', 'Weighted SD2', 'Weighted DSP', 'Weighted DPR']].sum().sum()
+    total_revenue = monthly['Revenue'].sum()
     overall_avg_discount_rate = total_discounts / total_revenue
 
-    delta_ref = overall_avg_discount_rate - np.mean(monthly_discounts['Avg Discount Rate']) * 100
+    delta_ref = overall_avg_discount_rate - np.mean(monthly['Avg Discount Rate']) * 100
     fig = go.Figure(
         go.Indicator(
             mode="number+delta",
@@ -135,8 +108,8 @@ def average_discount_rate_card(df):
         ))
 
     fig.add_trace(go.Scatter(
-        x=monthly_discounts["MONTH"],
-        y=monthly_discounts["Avg Discount Rate"] * 100,  # Convert proportion to percentage for plotting
+        x=monthly["MONTH"],
+        y=monthly["Avg Discount Rate"] * 100,  # Convert proportion to percentage for plotting
         mode="lines",
         fill='tozeroy',
         name="Avg Discount Rate",
@@ -150,16 +123,10 @@ def average_discount_rate_card(df):
     return fig
 
 
-def average_selling_price_card(df):
-    # Calculate the Average Selling Price (ASP) by dividing total revenue by total units sold
-    # Group by month to get monthly ASP
-    monthly_sales = df.groupby("MONTH").agg({"Revenue": "sum", "QTY [Units]": "sum"})
-    monthly_sales = monthly_sales.reindex(MONTHS_ORDER).reset_index()
-    monthly_sales['ASP'] = monthly_sales['Revenue'] / monthly_sales['QTY [Units]']
-
+def average_selling_price_card(monthly):
     # Calculate the total Average Selling Price across all months
-    total_revenue = monthly_sales['Revenue'].sum()
-    total_units_sold = monthly_sales['QTY [Units]'].sum()
+    total_revenue = monthly['Revenue'].sum()
+    total_units_sold = monthly['QTY [Units]'].sum()
     overall_asp = total_revenue / total_units_sold
 
     fig = go.Figure(
@@ -172,8 +139,8 @@ def average_selling_price_card(df):
         ))
 
     fig.add_trace(go.Scatter(
-        x=monthly_sales["MONTH"],
-        y=monthly_sales["ASP"],
+        x=monthly["MONTH"],
+        y=monthly["ASP"],
         mode="lines",
         fill='tozeroy',
         name="Average Selling Price",
@@ -187,29 +154,22 @@ def average_selling_price_card(df):
     return fig
 
 
-def income_statement(df):
-    df['CoGS'] = df['Total Cost [CAD]']
-    df['Total Expense'] = df['Standard Discount [SD1][CAD]'] + df['Standard Discount [SD2][CAD]'] + df[
-        'Special Discount [DSP][CAD]'] + df['Promo Campaign [DPR][CAD]']
-    df['Net Profit'] = df['Revenue'] - df['Total Expense'] - df['CoGS']
-
-    fin_data = df.groupby("MONTH")['Total Expense', 'CoGS', 'Revenue', 'Net Profit'].sum()
-    fin_data = fin_data.reindex(MONTHS_ORDER).reset_index()
+def income_statement(monthly):
     fig = go.Figure()
     fig.add_trace(
-        go.Bar(x=fin_data["MONTH"], y=fin_data["Total Expense"], name="Total Expense",
+        go.Bar(x=monthly["MONTH"], y=monthly["Total Expense"], name="Total Expense",
                marker=dict(color=colors[0]))
     )
     fig.add_trace(
-        go.Bar(x=fin_data["MONTH"], y=fin_data["CoGS"], name="CoGS",
+        go.Bar(x=monthly["MONTH"], y=monthly["CoGS"], name="CoGS",
                marker=dict(color=colors[1]))
     )
     fig.add_trace(
-        go.Bar(x=fin_data["MONTH"], y=fin_data["Revenue"], name="Revenue",
+        go.Bar(x=monthly["MONTH"], y=monthly["Revenue"], name="Revenue",
                marker=dict(color=colors[2]))
     )
     fig.add_trace(
-        go.Bar(x=fin_data["MONTH"], y=fin_data["Net Profit"], name="Net Profit",
+        go.Bar(x=monthly["MONTH"], y=monthly["Net Profit"], name="Net Profit",
                marker=dict(color=colors[3]))
     )
     fig.update_layout(barmode="group", title="Income Statement", xaxis_title="Month",
@@ -220,10 +180,8 @@ def income_statement(df):
     return fig
 
 
-def expenses_pie(df):
-    summed_discounts = df[['Standard Discount [SD1][CAD]', 'Standard Discount [SD2][CAD]',
-                           'Special Discount [DSP][CAD]', 'Promo Campaign [DPR][CAD]',
-                           'Rebates [DREB][CAD]']].sum()
+def expenses_pie(monthly):
+    summed_discounts = monthly[EXPENSE_COLUMNS].sum()
     fig = go.Figure(data=[
         go.Pie(labels=summed_discounts.index, values=summed_discounts.values, hole=.4,
                marker_colors=colors)
@@ -239,8 +197,8 @@ def expenses_pie(df):
     return fig
 
 
-def monthly_rev_gm(filtered_data):
-    revenue_data = filtered_data.groupby("MONTH")["Revenue", "Total GM [CAD]"].sum()
+def monthly_rev_gm(cube):
+    revenue_data = cube.groupby("MONTH", observed=True)[["Revenue", "Total GM [CAD]"]].sum()
     revenue_data = revenue_data.reindex(MONTHS_ORDER).reset_index()
     fig = go.Figure()
     fig.add_trace(go.Scatter(
@@ -254,23 +212,20 @@ def monthly_rev_gm(filtered_data):
     return fig
 
 
-def product_performance(df):
-    df["Unit GM [%]"] = pd.to_numeric(df['Unit GM [%]'], errors='coerce')
-    prod_data = df.groupby("Product Range").agg(
-        {"Unit GM [%]": "mean",
-         "QTY [Units]": "sum"}
-    ).reset_index()
-    prod_data = prod_data.sort_values(by="QTY [Units]", ascending=False)
+def product_performance(cube):
+    prod_data = cube.groupby("Product Range", observed=True)[["QTY [Units]"]].sum()
+    prod_data["Unit GM [%]"] = cube_mean(cube, "Product Range", "Unit GM [%]")
+    prod_data = prod_data.reset_index().sort_values(by="QTY [Units]", ascending=False)
     fig = make_subplots(specs=[[{"secondary_y": True}]])
     fig.add_trace(
         go.Bar(
-            x=prod_data["Product Range"], y=df["QTY [Units]"], name="Quantity Sold",
+            x=prod_data["Product Range"], y=prod_data["QTY [Units]"], name="Quantity Sold",
             marker=dict(color="#264653")
         ), secondary_y=False
     )
     fig.add_trace(
         go.Scatter(
-            x=prod_data["Product Range"], y=df["Unit GM [%]"], name="Profit Margin Contribution",
+            x=prod_data["Product Range"], y=prod_data["Unit GM [%]"], name="Profit Margin Contribution",
             marker=dict(color="#e76f51"), mode="markers+lines"
         ), secondary_y=True
     )
@@ -279,8 +234,8 @@ def product_performance(df):
     return fig
 
 
-def rev_by_customer(df):
-    prod_data = df.groupby("Customer Name")[["Revenue", "Total GM [CAD]", "QTY [Units]"]].sum().reset_index()
+def rev_by_customer(cube, top_n=TOP_CUSTOMERS):
+    prod_data = top_n_with_other(customer_totals(cube), "Customer Name", "Revenue", top_n)
     fig = make_subplots(rows=1, cols=3, specs=[[{'type': 'domain'}, {'type': 'domain'}, {'type': 'domain'}]])
     fig.add_trace(
         go.Pie(labels=prod_data["Customer Name"], values=prod_data["Revenue"], name="Revenue",
@@ -305,13 +260,12 @@ def rev_by_customer(df):
     return fig
 
 
-def avg_disc_given(df):
-    df["Total Discount"] = df['Standard Discount [SD1][CAD]'] + df['Standard Discount [SD2][CAD]'] + df[
-        'Special Discount [DSP][CAD]']
-    df = df.groupby("Customer Name")["Total Discount"].mean().reset_index()
+def avg_disc_given(cube, top_n=TOP_CUSTOMERS):
+    disc_data = top_n_with_other(customer_totals(cube), "Customer Name", "Avg Discount", top_n)
+    disc_data["Avg Discount"] = disc_data["Total Discount"] / disc_data["Total Discount Count"]
 
     fig = go.Figure(
-        go.Bar(x=df["Customer Name"], y=df["Total Discount"],
+        go.Bar(x=disc_data["Customer Name"], y=disc_data["Avg Discount"],
                marker=dict(color=colors[0]))
     )
     fig.update_layout(
@@ -320,9 +274,9 @@ def avg_disc_given(df):
     return fig
 
 
-def clv_plot(df):
-    # Calculate Customer Lifetime Value approximation
-    clv = df.groupby('Customer Name')['Revenue'].sum().sort_values(ascending=False).reset_index()
+def clv_plot(cube, top_n=TOP_CUSTOMERS):
+    # Calculate Customer Lifetime Value approximation, the long tail ends in a single "Other" bar
+    clv = top_n_with_other(customer_totals(cube), "Customer Name", "Revenue", top_n)
 
     # Calculate the cumulative sum of revenue and the cumulative percentage
     clv['Cumulative Revenue'] = clv['Revenue'].cumsum()
@@ -343,13 +297,13 @@ def clv_plot(df):
     return fig_clv
 
 
-def average_list_price_card(df):
-    monthly_sales = df.groupby("MONTH")["List Price [CAD]"].mean()
+def average_list_price_card(cube):
+    monthly_sales = cube_mean(cube, "MONTH", "List Price [CAD]").rename("List Price [CAD]")
     monthly_sales = monthly_sales.reindex(MONTHS_ORDER).reset_index()
     fig = go.Figure(
         go.Indicator(
             mode="number",
-            value=df["List Price [CAD]"].mean(),
+            value=cube["List Price [CAD]"].sum() / cube["List Price [CAD] Count"].sum(),
             number={"prefix": "C$", "font": {"size": 32}},
             title={"text": "Average List Price", "font": {"size": 20}},
             domain={'y': [0, 1], 'x': [0.25, 0.75]}
@@ -370,13 +324,13 @@ def average_list_price_card(df):
     return fig
 
 
-def total_prod_qty_card(df):
-    monthly_sales = df.groupby("MONTH")["QTY [Units]"].sum()
+def total_prod_qty_card(cube):
+    monthly_sales = cube.groupby("MONTH", observed=True)["QTY [Units]"].sum()
     monthly_sales = monthly_sales.reindex(MONTHS_ORDER).reset_index()
     fig = go.Figure(
         go.Indicator(
             mode="number",
-            value=df["QTY [Units]"].sum(),
+            value=cube["QTY [Units]"].sum(),
             number={"suffix": " units", "font": {"size": 32}},
             title={"text": "Qty Sold", "font": {"size": 20}},
             domain={'y': [0, 1], 'x': [0.25, 0.75]}
@@ -397,13 +351,13 @@ def total_prod_qty_card(df):
     return fig
 
 
-def total_prod_rev_card(df):
-    monthly_sales = df.groupby("MONTH")["Revenue"].sum()
+def total_prod_rev_card(cube):
+    monthly_sales = cube.groupby("MONTH", observed=True)["Revenue"].sum()
     monthly_sales = monthly_sales.reindex(MONTHS_ORDER).reset_index()
     fig = go.Figure(
         go.Indicator(
             mode="number",
-            value=df["Revenue"].sum(),
+            value=cube["Revenue"].sum(),
             number={"prefix": "C$ ", "font": {"size": 32}},
             title={"text": "Total Revenue", "font": {"size": 20}},
             domain={'y': [0, 1], 'x': [0.25, 0.75]}
@@ -424,13 +378,13 @@ def total_prod_rev_card(df):
     return fig
 
 
-def total_prod_GM_card(df):
-    monthly_sales = df.groupby("MONTH")["Total GM [CAD]"].sum()
+def total_prod_GM_card(cube):
+    monthly_sales = cube.groupby("MONTH", observed=True)["Total GM [CAD]"].sum()
     monthly_sales = monthly_sales.reindex(MONTHS_ORDER).reset_index()
     fig = go.Figure(
         go.Indicator(
             mode="number",
-            value=df["Total GM [CAD]"].sum(),
+            value=cube["Total GM [CAD]"].sum(),
             number={"prefix": "C$ ", "font": {"size": 32}},
             title={"text": "Profit Margin", "font": {"size": 20}},
             domain={'y': [0, 1], 'x': [0.25, 0.75]}
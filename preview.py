@@ -0,0 +1,106 @@
+import io
+
+import numpy as np
+import pandas as pd
+
+from aggregates import *
+
+# Strata of the preview sample, every cube row lies in exactly one of them
+STRATA = ["YEAR", "MONTH", "Channel Category", "Product Category"]
+
+# The preview reads this many blocks spread over the file, a few MB regardless of the file size
+PREVIEW_BLOCKS = 256
+PREVIEW_BLOCK_BYTES = 64 * 1024
+
+# Rows kept per stratum, small strata are kept whole
+PREVIEW_ROWS_PER_STRATUM = 500
+
+# Two-sided 95% normal quantile of the reported error
+Z_95 = 1.96
+
+
+def read_csv_blocks(file, size, blocks=PREVIEW_BLOCKS, block_bytes=PREVIEW_BLOCK_BYTES, seed=0):
+    # Systematic sample of byte blocks: the file is cut into `blocks` stretches and one block is read at a random
+    # offset in each, so an export sorted by period still contributes every period. Partial lines at the block
+    # edges are dropped, which assumes no line breaks inside quoted fields.
+    # Returns the sampled rows and the estimated number of rows in the file.
+    file.seek(0)
+    header = file.readline()
+    start = file.tell()
+    if size - start <= blocks * block_bytes:
+        file.seek(0)
+        rows = pd.read_csv(file, encoding="UTF-8")
+        return rows, len(rows)
+
+    rng = np.random.default_rng(seed)
+    stretch = (size - start) / blocks
+    pieces = []
+    for block in range(blocks):
+        file.seek(int(start + block * stretch + rng.random() * (stretch - block_bytes)))
+        data = file.read(block_bytes)
+        first, last = data.find(b"\n"), data.rfind(b"\n")
+        if first < last:
+            pieces.append(data[first + 1:last + 1])
+    sampled = b"".join(pieces)
+    rows = pd.read_csv(io.BytesIO(header + sampled), encoding="UTF-8")
+    return rows, int(len(rows) * (size - start) / max(len(sampled), 1))
+
+
+def stratify(rows, total_rows, per_stratum=PREVIEW_ROWS_PER_STRATUM, seed=0):
+    # Post-stratification of the sampled rows: at most `per_stratum` rows are kept per stratum and each carries
+    # the weight N_h / n_h, the stratum size N_h being estimated from the stratum's share of the sampled rows
+    strata = rows.groupby(STRATA, observed=True, dropna=False).ngroup().to_numpy()
+    counts = np.bincount(strata)
+    shuffled = pd.Series(strata).sample(frac=1, random_state=seed)
+    rank = shuffled.groupby(shuffled.to_numpy()).cumcount()
+    keep = np.sort(rank[rank < per_stratum].index.to_numpy())
+
+    sample = rows.iloc[keep].reset_index(drop=True)
+    sizes = total_rows * counts / len(rows)
+    kept = np.minimum(counts, per_stratum)
+    weights = (sizes / kept)[strata[keep]]
+    return sample, weights, strata[keep], sizes, kept
+
+
+def revenue_error(sample, weights, strata, sizes, kept):
+    # Relative half-width of the 95% interval of the total revenue under stratified sampling:
+    # Var = sum_h N_h^2 (1 - n_h / N_h) s_h^2 / n_h, strata with a single row contribute no variance
+    revenue = sample["Revenue"].to_numpy(dtype=np.float64)
+    variances = pd.Series(revenue).groupby(strata).var().reindex(range(len(sizes))).fillna(0).to_numpy()
+    variance = np.sum(sizes ** 2 * (1 - kept / np.maximum(sizes, kept)) * variances / kept)
+    total = np.nansum(revenue * weights)
+    return Z_95 * np.sqrt(variance) / total if total else np.nan
+
+
+def scale_cube(cube, sample, weights):
+    # Cube rows are finer than the strata, so each row is scaled with its stratum's weight; sums and counts
+    # scale alike, the averages rebuilt from them stay weighted means
+    stratum_weights = sample[STRATA].assign(weight=weights).drop_duplicates(STRATA)
+    cube = cube.merge(stratum_weights, on=STRATA, how="left")
+    measures = [column for column in cube.columns if column not in CUBE_DIMENSIONS + ["weight"]]
+    cube[measures] = cube[measures].to_numpy(dtype=np.float64) * cube["weight"].to_numpy()[:, None]
+    return encode_dimensions(cube.drop(columns="weight"))
+
+
+@instrument
+def build_preview(file, size):
+    # Approximate dataset from a few MB of the file: sums are scaled up estimates, the error of the total
+    # revenue is reported alongside. The exact dataset is expected to replace it.
+    rows, total_rows = read_csv_blocks(file, size)
+    rows = pre_process_data(rows)
+    sample, weights, strata, sizes, kept = stratify(rows, total_rows)
+
+    weighted = sample.copy()
+    for column in weighted.columns:
+        if column != "YEAR" and pd.api.types.is_numeric_dtype(weighted[column]):
+            weighted[column] = weighted[column].to_numpy(dtype=np.float64) * weights
+    cube = scale_cube(build_cube(sample), sample, weights)
+    dataset = {
+        "rows": None,
+        "monthly": finish_monthly(monthly_totals(weighted)),
+        "cube": cube,
+        "filter_index": FilterIndex(cube),
+    }
+    estimate = {"sample_rows": len(sample), "estimated_rows": total_rows,
+                "revenue_error": revenue_error(sample, weights, strata, sizes, kept)}
+    return dataset, estimate
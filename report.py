@@ -0,0 +1,193 @@
+import argparse
+import html
+import json
+import multiprocessing
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import pandas as pd
+from plotly.offline import get_plotlyjs
+
+from aggregates import build_dataset
+from cache import content_hash
+from ingest import excel_sheets, read_excel_sheet
+from plots.compact import compact_figure
+from plots.plots import *
+from utils import (CSV_DTYPES, DERIVED_METRICS_VERSION, SCHEMA_COLUMNS, check_columns, pre_process_data,
+                   read_csv_header)
+
+# Bumped whenever the page layout changes, so every report is rendered again
+REPORT_VERSION = 2
+
+EXCEL_TYPES = {".xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+               ".xls": "application/vnd.ms-excel"}
+
+# Charts of each dashboard tab, in the order the app lays them out
+TABS = {
+    "overview": [sales_revenue_card, units_sold_card, profit_margin_card, average_discount_rate_card,
+                 average_selling_price_card, income_statement, expenses_pie],
+    "customer-insights": [rev_by_customer, avg_disc_given, clv_plot],
+    "product-performance": [average_list_price_card, total_prod_qty_card, total_prod_rev_card, total_prod_GM_card,
+                            monthly_rev_gm, product_performance],
+}
+
+PLOTLY_JS = "plotly.min.js"
+MANIFEST = "manifest.json"
+
+PAGE = """<!DOCTYPE html>
+<html>
+<head><meta charset="utf-8"><title>{title}</title><script src="{plotly_js}"></script></head>
+<body style="font-family: sans-serif">
+<h1>{title}</h1>
+{figures}
+</body>
+</html>
+"""
+
+
+def read_export(path):
+    extension = os.path.splitext(path)[1].lower()
+    if extension in EXCEL_TYPES:
+        with open(path, "rb") as f:
+            return read_excel_sheet(f, EXCEL_TYPES[extension], excel_sheets(f, EXCEL_TYPES[extension])[0])
+    with open(path, "rb") as f:
+        check_columns(read_csv_header(f))
+        return pd.read_csv(f, encoding="UTF-8", usecols=SCHEMA_COLUMNS, dtype=CSV_DTYPES)
+
+
+def default_filters(filter_index):
+    # Without a configuration every year is reported per channel and per product family, like the sidebar offers
+    years = filter_index.options["YEAR"]
+    return {
+        "customer-insights": [{"YEAR": year, "Channel Category": channel} for year in years
+                              for channel in filter_index.options_for("Channel Category", {"YEAR": year})],
+        "product-performance": [{"YEAR": year, "Product Category": category, "Product Family": family}
+                                for (year, category), families in filter_index.families_by_category.items()
+                                for family in families],
+    }
+
+
+def output_name(path):
+    # File name plus a digest of the absolute path: exports with the same name in different folders, e.g.
+    # east/2024-01.csv and west/2024-01.csv, get their own directory, and it stays the same across runs
+    stem = os.path.splitext(os.path.basename(path))[0]
+    return f"{stem}-{content_hash(os.path.abspath(path).encode())[:8]}"
+
+
+def slug(filters):
+    values = [str(value) if not isinstance(value, list) else "+".join(map(str, value))
+              for value in filters.values()]
+    return re.sub(r"[^A-Za-z0-9+]+", "-", "_".join(values)).strip("-").lower()
+
+
+def write_page(path, title, figures, plotly_js):
+    fragments = "\n".join(fig.to_html(full_html=False, include_plotlyjs=False) for fig in figures)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(PAGE.format(title=html.escape(title), plotly_js=plotly_js, figures=fragments))
+    os.replace(tmp_path, path)
+
+
+def render_file(path, output_dir, config, previous):
+    # Runs in a worker process. Returns the manifest entry of `path`, unchanged inputs are skipped.
+    with open(path, "rb") as f:
+        digest = content_hash(f.read())
+    key = f"{digest}:v{DERIVED_METRICS_VERSION}:r{REPORT_VERSION}:{content_hash(json.dumps(config).encode())}"
+    if previous and previous["key"] == key and all(
+            os.path.exists(os.path.join(output_dir, page)) for page in previous["pages"]):
+        return {**previous, "skipped": True}
+
+    dataset = build_dataset(pre_process_data(read_export(path)))
+    name, directory = os.path.splitext(os.path.basename(path))[0], output_name(path)
+    os.makedirs(os.path.join(output_dir, directory), exist_ok=True)
+    cube, filter_index = dataset["cube"], dataset["filter_index"]
+    top_n = config.get("top_n", TOP_CUSTOMERS)
+    filters = {**default_filters(filter_index), **config.get("filters", {})}
+
+    pages = [os.path.join(directory, "overview.html")]
+    write_page(os.path.join(output_dir, pages[0]), f"{name} · Overview",
+               [compact_figure(builder(dataset["monthly"])) for builder in TABS["overview"]],
+               f"../{PLOTLY_JS}")
+    for tab in ["customer-insights", "product-performance"]:
+        options = {"top_n": top_n} if tab == "customer-insights" else {}
+        for selection in filters.get(tab, []):
+            data = filter_index.take(cube, selection)
+            page = os.path.join(directory, f"{tab}-{slug(selection)}.html")
+            title = f"{name} · {tab.replace('-', ' ').title()} · " + ", ".join(
+                f"{column}: {value}" for column, value in selection.items())
+            write_page(os.path.join(output_dir, page), title,
+                       [compact_figure(builder(data, **options)) for builder in TABS[tab]], f"../{PLOTLY_JS}")
+            pages.append(page)
+    return {"key": key, "pages": pages, "skipped": False}
+
+
+def write_index(output_dir, manifest):
+    links = "\n".join(f'<h2>{html.escape(path)}</h2><ul>' + "".join(
+        f'<li><a href="{html.escape(page)}">{html.escape(page)}</a></li>' for page in entry["pages"]) + "</ul>"
+        for path, entry in sorted(manifest.items()))
+    with open(os.path.join(output_dir, "index.html"), "w", encoding="utf-8") as f:
+        f.write(f'<!DOCTYPE html><html><head><meta charset="utf-8"><title>Reports</title></head>'
+                f'<body style="font-family: sans-serif">{links}</body></html>')
+
+
+def run(inputs, output_dir, config, workers):
+    paths = [os.path.abspath(path) for path in inputs]
+    repeated = sorted({path for path in paths if paths.count(path) > 1})
+    if repeated:
+        raise ValueError(f"Inputs given more than once: {', '.join(repeated)}")
+    os.makedirs(output_dir, exist_ok=True)
+    # plotly.js (~3.5 MB) is written once and referenced by every page
+    plotly_path = os.path.join(output_dir, PLOTLY_JS)
+    if not os.path.exists(plotly_path):
+        with open(plotly_path, "w", encoding="utf-8") as f:
+            f.write(get_plotlyjs())
+
+    manifest_path = os.path.join(output_dir, MANIFEST)
+    previous = {}
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            previous = json.load(f)
+
+    # Inputs not passed this time keep their entries and pages
+    manifest, failures = dict(previous), []
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+        futures = {pool.submit(render_file, path, output_dir, config, previous.get(os.path.abspath(path))): path
+                   for path in inputs}
+        for future in as_completed(futures):
+            path = futures[future]
+            try:
+                entry = future.result()
+            except Exception as error:  # one broken export must not stop the batch
+                failures.append(path)
+                print(f"failed   {path}: {error}")
+                continue
+            print(f"{'skipped' if entry.pop('skipped') else 'rendered'} {path} ({len(entry['pages'])} pages)")
+            manifest[os.path.abspath(path)] = entry
+
+    tmp_path = f"{manifest_path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, manifest_path)
+    write_index(output_dir, manifest)
+    return failures
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Render the dashboard tabs of sales exports to standalone HTML")
+    parser.add_argument("inputs", nargs="+", help="CSV or Excel exports")
+    parser.add_argument("--output", default="reports", help="Output directory")
+    parser.add_argument("--config", help='JSON file with "filters" per tab and "top_n", see the Readme')
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    args = parser.parse_args()
+
+    config = {}
+    if args.config:
+        with open(args.config) as f:
+            config = json.load(f)
+    try:
+        failures = run(args.inputs, args.output, config, args.workers)
+    except ValueError as error:
+        parser.error(str(error))
+    if failures:
+        raise SystemExit(1)
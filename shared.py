@@ -0,0 +1,91 @@
+import json
+import os
+import shutil
+import tempfile
+
+import pyarrow as pa
+import pyarrow.feather as feather
+
+from aggregates import dataset_from_aggregates
+
+# Frames of a dataset written to the shared directory, one uncompressed Arrow IPC (Feather v2) file each
+SHARED_FRAMES = ["rows", "monthly", "cube"]
+
+
+def shared_path(shared_dir, key):
+    # Dataset keys contain ':' which is not allowed in file names everywhere
+    return os.path.join(shared_dir, key.replace(":", "-"))
+
+
+def _to_table(df):
+    # Float NaN is kept as a value rather than turned into an Arrow null: without a validity bitmap the column
+    # converts back to NumPy without a copy
+    arrays = [pa.array(df[column].to_numpy(), from_pandas=False) if df[column].dtype.kind == "f"
+              else pa.Array.from_pandas(df[column]) for column in df.columns]
+    table = pa.Table.from_arrays(arrays, names=[str(column) for column in df.columns])
+    return table.replace_schema_metadata({"attrs": json.dumps(df.attrs)})
+
+
+def write_shared_dataset(shared_dir, key, dataset):
+    # Written to a temporary directory first, so other processes never map a half written dataset
+    path = shared_path(shared_dir, key)
+    if os.path.exists(path):
+        return
+    os.makedirs(shared_dir, exist_ok=True)
+    tmp_path = tempfile.mkdtemp(dir=shared_dir, prefix=".tmp-")
+    try:
+        for name in SHARED_FRAMES:
+            if dataset[name] is not None:
+                table = _to_table(dataset[name])
+                # A single record batch per file: chunked columns would be concatenated, i.e. copied, on read
+                feather.write_feather(table, os.path.join(tmp_path, f"{name}.arrow"), compression="uncompressed",
+                                      chunksize=max(table.num_rows, 1))
+        os.rename(tmp_path, path)
+    except OSError:
+        # Another process shared the same dataset first
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        if not os.path.exists(path):
+            raise
+
+
+def _map_frame(path):
+    source = pa.memory_map(path)
+    table = pa.ipc.open_file(source).read_all()
+    df = table.to_pandas(split_blocks=True)
+    df.attrs = json.loads((table.schema.metadata or {}).get(b"attrs", b"{}"))
+
+    # Columns converted without a copy point into the mapping, their pages are shared by every process
+    # mapping the file and are not counted against the per-process cache budget
+    source.seek(0)
+    start = source.read_buffer(1).address
+    end = start + source.size()
+    mapped_bytes = 0
+    for column in df.columns:
+        values = df[column].to_numpy() if df[column].dtype.kind in "biuf" else None
+        if values is not None and start <= values.__array_interface__["data"][0] < end:
+            mapped_bytes += values.nbytes
+    df.attrs["mapped_bytes"] = mapped_bytes
+    return df
+
+
+def open_shared_dataset(shared_dir, key):
+    path = shared_path(shared_dir, key)
+    frames = {}
+    try:
+        # Marks the dataset as recently used for prune_directory
+        os.utime(path)
+        for name in SHARED_FRAMES:
+            frame_path = os.path.join(path, f"{name}.arrow")
+            frames[name] = _map_frame(frame_path) if os.path.exists(frame_path) else None
+    except FileNotFoundError:
+        # Never shared, or pruned meanwhile
+        return None
+    dataset = dataset_from_aggregates(frames["monthly"], frames["cube"])
+    dataset["rows"] = frames["rows"]
+    return dataset
+
+
+def share_dataset(shared_dir, key, dataset):
+    # Replaces the private frames of a freshly built dataset with their memory-mapped copies
+    write_shared_dataset(shared_dir, key, dataset)
+    return open_shared_dataset(shared_dir, key)
@@ -0,0 +1,61 @@
+import io
+from datetime import datetime, timezone
+
+import gridfs
+import pandas as pd
+from pymongo import ASCENDING
+
+from aggregates import dataset_from_aggregates
+
+# Aggregate rows are split over several documents to stay well below MongoDB's 16 MB document limit
+AGGREGATE_ROWS_PER_DOCUMENT = 10_000
+
+
+def _bucket(db):
+    return gridfs.GridFSBucket(db, bucket_name="datasets")
+
+
+def save_dataset(db, key, name, dataset):
+    # Rows go to GridFS as Parquet, the monthly summary and the cube go to regular documents keyed by `key`
+    rows_file_id = None
+    if dataset["rows"] is not None:
+        buffer = io.BytesIO()
+        dataset["rows"].to_parquet(buffer, index=False)
+        buffer.seek(0)
+        rows_file_id = _bucket(db).upload_from_stream(f"{key}.parquet", buffer, metadata={"dataset": key})
+
+    db.dataset_aggregates.delete_many({"dataset": key})
+    db.dataset_aggregates.create_index([("dataset", ASCENDING), ("name", ASCENDING), ("part", ASCENDING)])
+    for aggregate in ["monthly", "cube"]:
+        records = dataset[aggregate].to_dict("records")
+        documents = [
+            {"dataset": key, "name": aggregate, "part": part,
+             "records": records[start:start + AGGREGATE_ROWS_PER_DOCUMENT]}
+            for part, start in enumerate(range(0, max(len(records), 1), AGGREGATE_ROWS_PER_DOCUMENT))
+        ]
+        db.dataset_aggregates.insert_many(documents)
+
+    previous = db.datasets.find_one_and_replace(
+        {"_id": key},
+        {"_id": key, "name": name, "rows": None if dataset["rows"] is None else len(dataset["rows"]),
+         "rows_file_id": rows_file_id, "saved_at": datetime.now(timezone.utc)},
+        upsert=True,
+    )
+    if previous and previous.get("rows_file_id") is not None:
+        _bucket(db).delete(previous["rows_file_id"])
+
+
+def list_datasets(db):
+    return list(db.datasets.find({}, projection={"name": 1, "rows": 1, "saved_at": 1}).sort("saved_at", -1))
+
+
+def _load_aggregate(db, key, name):
+    documents = db.dataset_aggregates.find({"dataset": key, "name": name},
+                                           projection={"_id": 0, "records": 1}).sort("part", ASCENDING)
+    return pd.DataFrame([record for document in documents for record in document["records"]])
+
+
+def load_dataset_aggregates(db, key):
+    # Only the aggregates are read, the dashboards never need the rows kept in GridFS
+    return dataset_from_aggregates(_load_aggregate(db, key, "monthly"), _load_aggregate(db, key, "cube"))
+
@@ -0,0 +1,45 @@
+import time
+
+import pytest
+
+mongomock = pytest.importorskip("mongomock")
+
+from auth import check_user, ensure_user_index, make_session_token, verify_session_token
+
+SECRET = "test-secret"
+
+
+@pytest.fixture
+def users():
+    users = mongomock.MongoClient().db.users
+    ensure_user_index(users)
+    users.insert_many([{"username": "alice", "password": "secret"},
+                       {"username": "jörg", "password": "pässwort"}])
+    return users
+
+
+def test_check_user(users):
+    assert check_user(users, "alice", "secret")
+    assert not check_user(users, "alice", "wrong")
+    assert not check_user(users, "bob", "secret")
+
+
+def test_check_user_non_ascii(users):
+    assert check_user(users, "jörg", "pässwort")
+    assert not check_user(users, "jörg", "passwort")
+    assert not check_user(users, "alice", "sécret")
+
+
+def test_session_token():
+    token = make_session_token("alice", SECRET)
+    assert verify_session_token(token, SECRET) == "alice"
+    assert verify_session_token(token, "other-secret") is None
+    assert verify_session_token(token.replace("alice", "admin", 1), SECRET) is None
+    assert verify_session_token("garbage", SECRET) is None
+    assert verify_session_token("", SECRET) is None
+
+
+def test_session_token_expired():
+    token = make_session_token("alice", SECRET, issued_at=int(time.time()) - 3600)
+    assert verify_session_token(token, SECRET, max_age=60) is None
+    assert verify_session_token(token, SECRET, max_age=7200) == "alice"
@@ -1,4 +1,10 @@
+import difflib
+
+import numpy as np
 import pandas as pd
+from pandas.api.types import union_categoricals
+
+from instrumentation import instrument
 
 MONTHS_ORDER = ["Jan", "Feb", "Mar", "April", "May",
                 "Jun", "Jul", "Aug", "Sept", "Oct",
@@ -34,14 +40,228 @@ def update_hover_layout(fig):
     return fig
 
 
+# Declared schema of the sales export: low-cardinality strings become categoricals, measures are downcast
+CATEGORY_COLUMNS = ["MONTH", "Channel Category", "Customer Name",
+                    "Product Category", "Product Family", "Product Range"]
+INTEGER_COLUMNS = ["YEAR", "QTY [Units]"]
+FLOAT_COLUMNS = ["Revenue", "Total GM [CAD]", "Total Cost [CAD]", "List Price [CAD]",
+                 "Standard Discount [SD1][CAD]", "Standard Discount [SD2][CAD]",
+                 "Special Discount [DSP][CAD]", "Promo Campaign [DPR][CAD]", "Rebates [DREB][CAD]",
+                 "Standard Discount [SD1 %]", "Standard Discount [SD2 %]",
+                 "Special Discount [DSP %]", "Promo Campaign [DPR%]"]
+
+# Revenue-weighted discount rates, assuming rates are stored as proportions (e.g., 20% is stored as 0.20)
+WEIGHTED_DISCOUNT_COLUMNS = {
+    'Weighted SD1': 'Standard Discount [SD1 %]',
+    'Weighted SD2': 'Standard Discount [SD2 %]',
+    'Weighted DSP': 'Special Discount [DSP %]',
+    'Weighted DPR': 'Promo Campaign [DPR%]',
+}
+
+# Every column of the schema must be present, numeric ones are coerced in one pass on load
+NUMERIC_COLUMNS = INTEGER_COLUMNS + FLOAT_COLUMNS + ["Unit GM [%]"]
+SCHEMA_COLUMNS = CATEGORY_COLUMNS + NUMERIC_COLUMNS
+
+# dtypes fixed while parsing CSV files: dimensions are categorical straight from the parser
+CSV_DTYPES = {column: "category" for column in CATEGORY_COLUMNS}
+
+DERIVED_COLUMNS = ["Total Discount", "Total Expense", "Net Profit", "Unit GM [%]"] + list(WEIGHTED_DISCOUNT_COLUMNS)
+
+# Bump whenever a derived metric definition changes so cached datasets are rebuilt
+DERIVED_METRICS_VERSION = 1
+
+# Rows per chunk when streaming large CSV files
+CSV_CHUNK_ROWS = 250_000
+
+# Largest absolute error accepted when narrowing a float column to float32 (half a cent)
+FLOAT32_TOLERANCE = 0.005
+
+
+class SchemaError(ValueError):
+    """
+    Raised when an export lacks columns of the declared schema, before its body is read.
+    """
+
+
+def check_columns(columns):
+    columns = [str(column) for column in columns]
+    missing = [column for column in SCHEMA_COLUMNS if column not in columns]
+    if not missing:
+        return
+    hints = []
+    for column in missing:
+        close = difflib.get_close_matches(column, columns, n=1, cutoff=0.8)
+        hints.append(f"'{column}'" + (f" (found '{close[0]}')" if close else ""))
+    raise SchemaError(f"Missing column{'s' if len(missing) > 1 else ''}: {', '.join(hints)}")
+
+
+def read_csv_header(file):
+    # Only the first line is parsed, the file position is restored for the actual read
+    position = file.tell()
+    columns = pd.read_csv(file, encoding="UTF-8", nrows=0).columns
+    file.seek(position)
+    return columns
+
+
+def coerce_numeric(df):
+    # One vectorized pass over the numeric schema columns. Columns the parser already read as numbers are left
+    # alone; in the others numeric text is converted ("coerced") and any other text becomes NaN ("invalid").
+    report = {"coerced": {}, "invalid": {}}
+    for column in NUMERIC_COLUMNS:
+        if pd.api.types.is_numeric_dtype(df[column]):
+            continue
+        present = df[column].notna().to_numpy()
+        numbers = pd.to_numeric(df[column], errors='coerce')
+        valid = numbers.notna().to_numpy()
+        report["coerced"][column] = int(np.count_nonzero(present & valid))
+        report["invalid"][column] = int(np.count_nonzero(present & ~valid))
+        df[column] = numbers
+    return df, report
+
+
+def merge_reports(reports):
+    merged = {"coerced": {}, "invalid": {}}
+    for report in reports:
+        for kind, counts in report.items():
+            for column, count in counts.items():
+                merged[kind][column] = merged[kind].get(column, 0) + count
+    return merged
+
+
+def format_bytes(value):
+    for unit in ["B", "KB", "MB", "GB"]:
+        if value < 1024:
+            return f'{value:.1f} {unit}'
+        value /= 1024
+    return f'{value:.1f} TB'
+
+
+def downcast_integer(series):
+    # int32 only when every value fits, otherwise the column is left as loaded
+    if not pd.api.types.is_integer_dtype(series) or series.empty:
+        return series
+    if series.min() >= np.iinfo(np.int32).min and series.max() <= np.iinfo(np.int32).max:
+        return series.astype(np.int32)
+    return series
+
+
+def downcast_float(series):
+    # float32 only when the round trip keeps every value within FLOAT32_TOLERANCE
+    narrowed = series.astype(np.float32)
+    error = np.abs(narrowed.to_numpy(dtype=np.float64) - series.to_numpy(dtype=np.float64))
+    if np.nanmax(error, initial=0) <= FLOAT32_TOLERANCE:
+        return narrowed
+    return series
+
+
+# --------------------------------- Row metrics ---------------------------------
+# Pure functions over NumPy views of the source columns, they never write to or copy the frame they read
+
+
+def total_discount(df):
+    return (df['Standard Discount [SD1][CAD]'].to_numpy() + df['Standard Discount [SD2][CAD]'].to_numpy()
+            + df['Special Discount [DSP][CAD]'].to_numpy())
+
+
+def total_expense(df, discount):
+    return discount + df['Promo Campaign [DPR][CAD]'].to_numpy()
+
+
+def net_profit(df, expense):
+    return df['Revenue'].to_numpy() - expense - df['Total Cost [CAD]'].to_numpy()
+
+
+def weighted_discounts(df):
+    revenue = df['Revenue'].to_numpy()
+    return {name: df[rate].to_numpy() * revenue for name, rate in WEIGHTED_DISCOUNT_COLUMNS.items()}
+
+
+@instrument
+def add_derived_metrics(df):
+    # Metrics read by the charts, derived once per dataset with the row metric functions above
+    discount = total_discount(df)
+    expense = total_expense(df, discount)
+
+    df['Total Discount'] = discount
+    df['Total Expense'] = expense
+    df['Net Profit'] = net_profit(df, expense)
+    for name, weighted in weighted_discounts(df).items():
+        df[name] = weighted
+    return df
+
+
+@instrument
+def optimize_dtypes(df):
+    memory_before = int(df.memory_usage(deep=True).sum())
+    for column in CATEGORY_COLUMNS:
+        if column in df.columns:
+            df[column] = df[column].astype("category")
+    for column in INTEGER_COLUMNS:
+        if column in df.columns:
+            df[column] = downcast_integer(df[column])
+    for column in FLOAT_COLUMNS:
+        if column in df.columns and pd.api.types.is_float_dtype(df[column]):
+            df[column] = downcast_float(df[column])
+    for column in DERIVED_COLUMNS:
+        if pd.api.types.is_float_dtype(df[column]):
+            df[column] = downcast_float(df[column])
+    memory_after = int(df.memory_usage(deep=True).sum())
+    return df, {"before": memory_before, "after": memory_after}
+
+
+@instrument
 def pre_process_data(df):
-    # Convert columns to float, coerce errors to NaN
-    df['Standard Discount [SD1][CAD]'] = pd.to_numeric(df['Standard Discount [SD1][CAD]'], errors='coerce')
-    df['Standard Discount [SD2][CAD]'] = pd.to_numeric(df['Standard Discount [SD2][CAD]'], errors='coerce')
-    df['Special Discount [DSP][CAD]'] = pd.to_numeric(df['Special Discount [DSP][CAD]'], errors='coerce')
-    df['Promo Campaign [DPR][CAD]'] = pd.to_numeric(df['Promo Campaign [DPR][CAD]'], errors='coerce')
+    # Frames not read through read_upload (e.g. built in memory) are checked here as well
+    check_columns(df.columns)
+    df, coercion_report = coerce_numeric(df)
 
+    df = add_derived_metrics(df)
+    df, memory_report = optimize_dtypes(df)
+    df.attrs["memory_report"] = memory_report
+    df.attrs["coercion_report"] = coercion_report
     return df
 
 
+def unify_categories(frames, columns):
+    # Frames built chunk by chunk carry their own category sets, concatenating them would fall back to object
+    # columns. The categories are unified on shallow copies so the concatenation stays categorical; the inputs
+    # are left untouched, one of them may be a cube already published to another thread.
+    frames = [frame.copy(deep=False) for frame in frames]
+    for column in columns:
+        if column in frames[0].columns and all(
+                isinstance(frame[column].dtype, pd.CategoricalDtype) for frame in frames):
+            categories = union_categoricals([frame[column] for frame in frames]).categories
+            for frame in frames:
+                frame[column] = frame[column].cat.set_categories(categories)
+    return frames
+
+
+def concat_rows(chunks):
+    # Pre-processed chunks possibly differ in their float widths as well, the dtypes are narrowed again over
+    # all rows once concatenated
+    chunks = unify_categories(chunks, CATEGORY_COLUMNS)
+    memory_before = sum(chunk.attrs.get("memory_report", {}).get("before", 0) for chunk in chunks)
+    coercion_report = merge_reports(chunk.attrs.get("coercion_report", {}) for chunk in chunks)
+    df, memory_report = optimize_dtypes(pd.concat(chunks, ignore_index=True))
+    df.attrs["memory_report"] = {"before": memory_before, "after": memory_report["after"]}
+    df.attrs["coercion_report"] = coercion_report
+    return df
+
+
+@instrument
+def read_upload(file_upload):
+    if file_upload.type == "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet":
+        return pd.read_excel(file_upload, engine="openpyxl")
+    elif file_upload.type == "application/vnd.ms-excel":  # Check if it's an XLS file
+        return pd.read_excel(file_upload)
+    elif file_upload.type == "text/csv":  # Check if it's a CSV file
+        check_columns(read_csv_header(file_upload))
+        return pd.read_csv(file_upload, encoding=("UTF-8"), usecols=SCHEMA_COLUMNS, dtype=CSV_DTYPES)
+    return pd.DataFrame()
+
 
+def read_csv_chunks(file_upload, chunksize=CSV_CHUNK_ROWS):
+    # The header is checked before the first chunk is parsed, only the schema columns are parsed at all
+    check_columns(read_csv_header(file_upload))
+    return pd.read_csv(file_upload, encoding=("UTF-8"), chunksize=chunksize, usecols=SCHEMA_COLUMNS,
+                       dtype=CSV_DTYPES)